@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# окна analysis(): скользящее среднее по 30 дням, std по 7
+MEAN_WINDOW = 30
+STD_WINDOW = 7
+SIGMA = 2
+
+
+def offsets_from_codes(codes, n_groups=None):
+    """
+    Смещения групп [offsets[g], offsets[g + 1]) для отсортированного массива кодов групп
+    """
+    counts = np.bincount(codes, minlength=n_groups or 0)
+    return np.concatenate([[0], np.cumsum(counts)])
+
+
+def _rolling_moments(values, offsets, window, with_std):
+    """
+    Скользящие mean (и std с ddof=1) окна window внутри каждой группы.
+
+    Суммы по окну берутся как разность кумулятивных сумм - O(1) на точку.
+    Значения предварительно центрируются по среднему группы, чтобы разность
+    больших сумм не теряла точность. Окно с NaN или короче window дает NaN,
+    как в pandas rolling(window)
+    """
+    n = len(values)
+    lengths = np.diff(offsets)
+    group_of = np.repeat(np.arange(len(lengths)), lengths)
+
+    isnan = np.isnan(values)
+    valid = np.where(isnan, 0.0, values)
+    counts = np.maximum(np.bincount(group_of, weights=~isnan, minlength=len(lengths)), 1)
+    center = (np.bincount(group_of, weights=valid, minlength=len(lengths)) / counts)[group_of]
+    shifted = np.where(isnan, 0.0, values - center)
+
+    def window_sum(x):
+        cs = np.concatenate([[0.0], np.cumsum(x)])
+        end = np.arange(1, n + 1)
+        return cs[end] - cs[np.maximum(end - window, 0)]
+
+    position = np.arange(n) - offsets[:-1][group_of]
+    full = (position >= window - 1) & (window_sum(isnan.astype(np.float64)) == 0)
+
+    s1 = window_sum(shifted)
+    mean = np.where(full, s1 / window + center, np.nan)
+    if not with_std:
+        return mean, None
+
+    s2 = window_sum(shifted * shifted)
+    var = np.maximum((s2 - s1 * s1 / window) / (window - 1), 0.0)
+    std = np.where(full, np.sqrt(var), np.nan)
+    return mean, std
+
+
+def rolling_mean_std(values, offsets, mean_window=MEAN_WINDOW, std_window=STD_WINDOW):
+    """
+    Ядро для всех расчетов аномалий: отсортированный по группам массив значений
+    и смещения групп -> скользящие mean (окно mean_window) и std (окно std_window)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if std_window == mean_window:
+        return _rolling_moments(values, offsets, mean_window, with_std=True)
+    mean, _ = _rolling_moments(values, offsets, mean_window, with_std=False)
+    _, std = _rolling_moments(values, offsets, std_window, with_std=True)
+    return mean, std
+
+
+def flag_anomalies(values, rolling_mean, rolling_std, sigma=SIGMA):
+    """
+    Аномалия - значение вне rolling_mean ± sigma * rolling_std
+    """
+    return (
+        (values > rolling_mean + sigma * rolling_std) |
+        (values < rolling_mean - sigma * rolling_std)
+    )
+
+
+def rolling_anomalies(df, by=None, mean_window=MEAN_WINDOW, std_window=STD_WINDOW,
+                      sigma=SIGMA, column='temperature'):
+    """
+    Скользящие mean/std и флаг аномалии для датафрейма.
+
+    by - колонка (или список колонок) групп, например 'city'; строки групп
+    не обязаны идти подряд, порядок строк внутри группы считается хронологическим.
+    Возвращает датафрейм с колонками rolling_mean, rolling_std, is_anomaly
+    с тем же индексом, что у df
+    """
+    values = df[column].to_numpy(dtype=np.float64)
+    if by is None:
+        order = None
+        offsets = np.array([0, len(values)])
+        sorted_values = values
+    else:
+        codes = df.groupby(by, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        order = np.argsort(codes, kind='stable')
+        offsets = offsets_from_codes(codes[order])
+        sorted_values = values[order]
+
+    rolling_mean, rolling_std = rolling_mean_std(sorted_values, offsets, mean_window, std_window)
+    if order is not None:
+        unsorted_mean = np.empty_like(rolling_mean)
+        unsorted_std = np.empty_like(rolling_std)
+        unsorted_mean[order] = rolling_mean
+        unsorted_std[order] = rolling_std
+        rolling_mean, rolling_std = unsorted_mean, unsorted_std
+
+    return pd.DataFrame({
+        'rolling_mean': rolling_mean,
+        'rolling_std': rolling_std,
+        'is_anomaly': flag_anomalies(values, rolling_mean, rolling_std, sigma),
+    }, index=df.index)
@@ -0,0 +1,328 @@
+"""
+Воспроизводимые замеры производительности на синтетических данных.
+
+Пример:
+    python benchmarks.py --cities 100 --years 10 --repeats 5 --output bench.json
+
+Каждый сценарий выполняется в отдельном процессе (чтобы пиковый RSS был честным)
+в каталоге со сгенерированным temperature_data.csv. Запросы к API идут
+в локальную заглушку (stub_server.py), кэш погоды и лимит частоты отключены.
+Результаты пишутся в JSON для сравнения между коммитами
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from stats_index import SEASONS, MONTH_TO_SEASON
+
+CASES = ['analysis', 'analyze_all', 'parallel_analysis', 'current_temp',
+         'async_current_temp', 'screen_all_current', 'dashboard']
+
+
+def generate_dataset(path, n_cities=15, n_years=10, seed=0, bad_dates=0, missing=0):
+    """
+    Синтетический temperature_data.csv в формате main.ipynb: ежедневные
+    температуры с сезонным средним города и нормальным шумом (scale=5).
+    bad_dates строк получают нераспознаваемую дату, missing - пустую температуру
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start='2010-01-01', periods=365 * n_years, freq='D')
+    seasons = dates.month.map(MONTH_TO_SEASON).to_numpy()
+    season_pos = pd.Categorical(seasons, categories=['winter', 'spring', 'summer', 'autumn']).codes
+
+    cities = [f'City {i}' for i in range(n_cities)]
+    seasonal_means = rng.uniform(-10, 30, size=(n_cities, 1)) + np.array([[-8, 0, 10, 2]])
+    temperature = rng.normal(seasonal_means[:, season_pos], 5)
+
+    df = pd.DataFrame({
+        'city': np.repeat(cities, len(dates)),
+        'timestamp': np.tile(dates, n_cities),
+        'temperature': temperature.ravel(),
+        'season': np.tile(seasons, n_cities),
+    })
+    if bad_dates:
+        df['timestamp'] = df['timestamp'].dt.strftime('%Y-%m-%d')
+        df.loc[rng.choice(len(df), bad_dates, replace=False), 'timestamp'] = 'not a date'
+    if missing:
+        df.loc[rng.choice(len(df), missing, replace=False), 'temperature'] = np.nan
+    df.to_csv(path, index=False)
+    return len(df)
+
+
+def summarize(times, rows=None, cities=None):
+    """
+    Сводка по повторам: среднее время, перцентили и пропускная способность
+    """
+    times = np.asarray(times)
+    summary = {
+        'repeats': len(times),
+        'mean': float(times.mean()),
+        'min': float(times.min()),
+        'p50': float(np.percentile(times, 50)),
+        'p95': float(np.percentile(times, 95)),
+        'max': float(times.max()),
+    }
+    if rows:
+        summary['rows_per_second'] = rows / summary['mean']
+    if cities:
+        summary['cities_per_second'] = cities / summary['mean']
+    return summary
+
+
+def measure(fn, repeats=5, warmup=1):
+    """
+    Время выполнения fn() по repeats повторам (после warmup прогревочных)
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS по процессам, МБ (Linux: ru_maxrss в КБ): самого процесса сценария
+    и самого большого из его дочерних процессов (воркеров пула).
+    Это значения на один процесс, не сумма: страницы memmap-хранилища общие
+    и входят в RSS каждого воркера, поэтому сумма считала бы их по разу на воркер.
+    Для parallel_analysis память на воркер должна оставаться плоской с ростом их числа
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+
+def _case_functions(case):
+    """
+    Функция одного прогона сценария. Импорт scripts здесь, а не в начале модуля:
+    он читает temperature_data.csv из текущего каталога
+    """
+    import scripts
+
+    cities = list(scripts.index.cities)
+
+    if case == 'analysis':
+        return lambda: [scripts.analysis(city) for city in cities]
+    if case == 'analyze_all':
+        return lambda: scripts.analyze_all(scripts.data)
+    if case == 'parallel_analysis':
+        return lambda: scripts.parallel_analysis(cities)
+    if case == 'current_temp':
+        return lambda: [scripts.current_temp(city) for city in cities]
+    if case == 'async_current_temp':
+        return lambda: asyncio.run(scripts.process_cities(cities))
+    if case == 'screen_all_current':
+        # после прогревочного прогона id городов в кэше - замеряются запросы /group
+        return lambda: scripts.screen_all_current(cities)
+    if case == 'dashboard':
+        import dashboard_data
+        from downsampling import points_for_width
+
+        n_points = points_for_width()
+
+        def dashboard():
+            # расчеты страниц "Анализ", "Сравнение" и рекомендаций по всем городам через
+            # dashboard_data, как их вызывает dashboard.py; кэш расчетов сбрасывается перед
+            # каждым повтором, чтобы замерялся первый показ, а не попадания в кэш
+            dashboard_data.store.clear()
+            index = scripts.index
+            for city in cities:
+                start, end = dashboard_data.date_range(dashboard_data.city_frame(index, city))
+                index.stats(city)
+                dashboard_data.seasonal_profile(index, city)
+                dashboard_data.line_points(index, city, start, end, n_points)
+                dashboard_data.histogram_points(index, city, start, end)
+                dashboard_data.spread_points(index, city, start, end, n_points)
+                dashboard_data.density_points(index, city, start, end)
+                dashboard_data.daily_avg_points(index, city, start, end, n_points)
+            start, end = dashboard_data.date_range(dashboard_data.comparison_frame(index, cities, 2))
+            dashboard_data.comparison_points(index, cities, start, end, n_points, 2)
+            dashboard_data.city_means(index, cities)
+            dashboard_data.season_values(index).rank('summer', 15, 25)
+        return dashboard
+    raise ValueError(f'Неизвестный сценарий: {case}')
+
+
+def _run_case(case, workdir, repeats, queue):
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    stop = None
+    if case in ('current_temp', 'async_current_temp', 'screen_all_current'):
+        from stub_server import start_stub_thread
+        base_url, stop = start_stub_thread(latency=0.01, jitter=0.01)
+        os.environ['OPENWEATHER_BASE_URL'] = base_url
+        os.environ['OPENWEATHER_API_KEY'] = 'stub'
+        os.environ['WEATHER_CACHE_TTL'] = '0'
+        # у заглушки нет тарифного плана - лимит частоты не нужен
+        os.environ['OPENWEATHER_RATE'] = '0'
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn = _case_functions(case)
+            setup = time.perf_counter() - start
+            times = measure(fn, repeats)
+        own, worker = peak_rss_mb()
+        queue.put({'setup_seconds': setup, 'times': times, 'peak_rss_mb': own, 'peak_worker_rss_mb': worker})
+    except Exception as e:
+        queue.put({'error': repr(e)})
+    finally:
+        if stop is not None:
+            stop()
+
+
+def run_case(case, workdir, repeats=5, rows=None, cities=None):
+    """
+    Прогон сценария в отдельном процессе; возвращает сводку с временем, перцентилями,
+    пропускной способностью и пиковым RSS процесса сценария и самого большого воркера
+    (см. peak_rss_mb)
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(case, workdir, repeats, queue))
+    process.start()
+    raw = queue.get()
+    process.join()
+    if 'error' in raw:
+        return raw
+    summary = summarize(raw['times'], rows, cities)
+    summary['setup_seconds'] = raw['setup_seconds']
+    summary['peak_rss_mb'] = raw['peak_rss_mb']
+    summary['peak_worker_rss_mb'] = raw['peak_worker_rss_mb']
+    return summary
+
+
+def compare_paths(csv_path='temperature_data.csv', chunksize=10_000):
+    """
+    Сверка analyze_all с parallel_analysis и stream_analysis (CSV по чанкам) по всем сезонам:
+    count и число аномалий должны совпадать точно, mean, min, max и наклон - до точности float32.
+    Возвращает список расхождений (пустой - пути согласованы)
+    """
+    import scripts
+    import streaming
+
+    problems = []
+    for season in SEASONS:
+        expected = scripts.analyze_all(scripts.data, season).set_index('city')
+        others = {
+            'parallel_analysis': scripts.parallel_analysis(list(expected.index), season),
+            'stream_analysis': streaming.stream_analysis(csv_path, season, chunksize)[0],
+        }
+        for name, other in others.items():
+            other = other.set_index('city').reindex(expected.index)
+            for column in ['count', 'anomalies', 'mean', 'min', 'max', 'slope']:
+                if column in ('count', 'anomalies'):
+                    same = expected[column].to_numpy() == other[column].to_numpy()
+                else:
+                    same = np.isclose(expected[column], other[column], rtol=1e-5, atol=1e-6, equal_nan=True)
+                if not same.all():
+                    problems.append(f'{name}, {season}, {column}: {list(expected.index[~same])}')
+    return problems
+
+
+def _run_check(workdir, queue):
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            queue.put(compare_paths())
+    except Exception as e:
+        queue.put([repr(e)])
+
+
+def check_consistency(n_cities=15, n_years=5, bad_dates=50, missing=50, seed=0):
+    """
+    Регрессионная проверка: на синтетических данных с нераспознаваемыми датами и пропусками
+    температуры analyze_all, parallel_analysis и streaming.py должны давать одну сводку
+    (см. compare_paths). Выполняется в отдельном процессе, возвращает список расхождений
+    """
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as workdir:
+        generate_dataset(os.path.join(workdir, 'temperature_data.csv'), n_cities, n_years, seed,
+                         bad_dates, missing)
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_check, args=(workdir, queue))
+        process.start()
+        problems = queue.get()
+        process.join()
+    return problems
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n_cities=15, n_years=10, repeats=5, cases=CASES, seed=0):
+    """
+    Генерирует данные и прогоняет выбранные сценарии, возвращает отчет (dict)
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        rows = generate_dataset(os.path.join(workdir, 'temperature_data.csv'), n_cities, n_years, seed)
+        results = {case: run_case(case, workdir, repeats, rows, n_cities) for case in cases}
+
+    return {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': {'cities': n_cities, 'years': n_years, 'rows': rows,
+                   'repeats': repeats, 'seed': seed},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности анализа температур')
+    parser.add_argument('--cities', type=int, default=15)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', nargs='+', default=CASES, choices=CASES)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--check', action='store_true',
+                        help='только сверить analyze_all, parallel_analysis и streaming.py на данных с ошибками')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check_consistency(args.cities, args.years, seed=args.seed)
+        for problem in problems:
+            print(f'расхождение: {problem}')
+        print('сводки совпадают' if not problems else f'расхождений: {len(problems)}')
+        sys.exit(1 if problems else 0)
+
+    report = run_benchmarks(args.cities, args.years, args.repeats, args.cases, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for case, summary in report['results'].items():
+        if 'error' in summary:
+            print(f'{case}: ошибка {summary["error"]}')
+        else:
+            workers = f', воркер: {summary["peak_worker_rss_mb"]:.0f} МБ' if summary['peak_worker_rss_mb'] else ''
+            print(f'{case}: {summary["mean"]:.4f} с (p95 {summary["p95"]:.4f} с), '
+                  f'{summary["rows_per_second"]:.0f} строк/с, {summary["peak_rss_mb"]:.0f} МБ{workers}')
+
+
+if __name__ == '__main__':
+    main()
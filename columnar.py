@@ -0,0 +1,352 @@
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows: сборки из разных процессов не сериализуются
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from stats_index import SEASONS, file_fingerprint, season_of, index_layout, trend_slope, trend_label
+from anomalies import rolling_mean_std, flag_anomalies
+from results import RollingAnalysisResult
+import metrics
+
+# версия формата хранилища: хранилище другой версии пересобирается
+STORE_VERSION = 2
+
+# колонки хранилища: имя -> тип на диске
+COLUMNS = {
+    'timestamp': np.int64,     # наносекунды с начала эпохи
+    'city': np.int32,          # код города, расшифровка в meta.json
+    'season': np.int8,         # индекс в SEASONS, -1 - сезон не распознан
+    'temperature': np.float32,
+    'row': np.int64,           # номер строки в исходном CSV
+}
+
+# календарные колонки, которые тоже лежат в хранилище: имя -> тип
+CALENDAR = {
+    'month': np.int8,          # 1..12, 0 - дата не распознана
+    'day_of_year': np.int16,   # 0..365 (см. day_of_year), -1 - дата не распознана
+    'season_number': np.int8,  # 1 - зима, 2 - весна, 3 - лето, 4 - осень (по месяцу), 0 - дата не распознана
+}
+
+# перестановка строк для CityIndex: по (город, сезон), внутри блока - по дате
+ORDER_FILE = 'season_order.npy'
+
+
+# первый день каждого месяца в високосном году: 29 февраля получает свой индекс
+_MONTH_STARTS = np.array([0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335])
+
+
+def day_of_year(month, day):
+    """
+    Индекс дня года 0..365 по месяцу и числу (без учета года)
+    """
+    return _MONTH_STARTS[np.asarray(month) - 1] + np.asarray(day) - 1
+
+
+def store_path(csv_path):
+    """
+    Каталог колоночного хранилища рядом с CSV
+    """
+    return csv_path + '.columns'
+
+
+# сколько хранилищ последних загрузок дашборда держать во временном каталоге
+UPLOAD_STORES = 3
+
+
+def upload_store_path(fingerprint):
+    """
+    Каталог хранилища для файла, загруженного в дашборд (по отпечатку содержимого)
+    """
+    return os.path.join(tempfile.gettempdir(), 'temperature-analysis', fingerprint)
+
+
+def prune_upload_stores(fingerprint, keep=None):
+    """
+    Отмечает хранилище загрузки fingerprint как использованное и удаляет хранилища
+    остальных загрузок (вместе с их моделями), кроме keep последних использованных.
+    keep по умолчанию - TEMPERATURE_UPLOAD_STORES из окружения или UPLOAD_STORES.
+    Уже подключенные через memmap колонки удаленного хранилища продолжают читаться
+    """
+    if keep is None:
+        keep = int(os.environ.get('TEMPERATURE_UPLOAD_STORES', UPLOAD_STORES))
+    current = upload_store_path(fingerprint)
+    os.utime(current)
+
+    root = os.path.dirname(current)
+    stores = []
+    for entry in os.scandir(root):
+        # каталоги идущих сборок и файлы блокировок (с точкой в имени) не трогаются
+        if entry.is_dir() and '.' not in entry.name and entry.path != current:
+            stores.append((entry.stat().st_mtime, entry.path))
+    for _, path in sorted(stores, reverse=True)[max(keep - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+        with contextlib.suppress(OSError):
+            os.remove(path + '.lock')
+
+
+@metrics.timed('load_data.parse_csv')
+def build_store(csv_path, store_dir=None, fingerprint=None):
+    """
+    Один раз переводит CSV в колоночный вид на диске: по .npy-файлу на колонку
+    (числовые даты, коды городов и сезонов, float32 температура, календарные колонки).
+
+    Строки уже отсортированы по (город, дата), при равных датах - в порядке CSV,
+    так что load_data ничего не сортирует и не пересчитывает. Раскладка CityIndex
+    (перестановка по сезонам, смещения блоков, статистики) тоже считается здесь:
+    перестановка - в season_order.npy, остальное - в meta.json вместе с именами
+    городов и отпечатком исходного CSV.
+    csv_path может быть и файловым объектом - тогда нужны store_dir и fingerprint.
+
+    Файлы пишутся в соседний временный каталог, который затем подменяет store_dir
+    целиком (см. _replace_dir): колонки, уже подключенные через memmap в других
+    процессах, остаются на старых файлах и не меняются под ними
+    """
+    store_dir = store_dir or store_path(csv_path)
+    fingerprint = fingerprint or file_fingerprint(csv_path)
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=os.path.basename(store_dir) + '.build-', dir=parent)
+    try:
+        # mkdtemp создает каталог только для владельца - права как у обычного каталога
+        os.chmod(build_dir, 0o755)
+        _write_store(csv_path, build_dir, fingerprint)
+        _replace_dir(build_dir, store_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return store_dir
+
+
+def _write_store(csv_path, store_dir, fingerprint):
+    df = pd.read_csv(csv_path)
+    timestamps = pd.to_datetime(df['timestamp'], errors='coerce')
+    if 'season' in df.columns:
+        seasons = df['season'].str.lower()
+    else:
+        seasons = season_of(timestamps)
+
+    city_codes, cities = pd.factorize(df['city'])
+    season_codes = pd.Categorical(seasons, categories=SEASONS).codes.astype(np.int8)
+    ns = timestamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    # стабильная сортировка по (город, дата) сохраняет порядок CSV при равных датах
+    order = np.lexsort((ns, city_codes))
+
+    columns = {
+        'timestamp': ns[order],
+        'city': city_codes[order],
+        'season': season_codes[order],
+        'temperature': df['temperature'].to_numpy()[order].astype(COLUMNS['temperature']),
+        'row': order,
+    }
+    calendar = add_calendar(pd.DataFrame({'timestamp': timestamps.iloc[order].reset_index(drop=True)}))
+    for name in CALENDAR:
+        columns[name] = calendar[name].to_numpy()
+    for name, dtype in {**COLUMNS, **CALENDAR}.items():
+        np.save(os.path.join(store_dir, f'{name}.npy'), columns[name].astype(dtype))
+
+    layout = index_layout(columns['city'], columns['season'], columns['temperature'], len(cities))
+    np.save(os.path.join(store_dir, ORDER_FILE), layout['order'].astype(np.int64))
+    # meta.json пишется последним: недописанное хранилище не считается актуальным
+    meta = {
+        'version': STORE_VERSION,
+        'fingerprint': fingerprint,
+        'cities': list(cities),
+        'offsets': layout['offsets'].tolist(),
+        'season_stats': layout['season_stats'].tolist(),
+        'city_stats': layout['city_stats'].tolist(),
+    }
+    with open(os.path.join(store_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def _replace_dir(new_dir, store_dir):
+    """
+    Подменяет каталог store_dir каталогом new_dir переименованиями. Старые файлы
+    удаляются только из каталога: открытые отображения держат их до закрытия
+    """
+    old_dir = None
+    if os.path.exists(store_dir):
+        old_dir = tempfile.mkdtemp(prefix=os.path.basename(store_dir) + '.old-', dir=os.path.dirname(new_dir))
+        os.rename(store_dir, os.path.join(old_dir, 'store'))
+    os.rename(new_dir, store_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def _build_lock(store_dir):
+    """
+    Блокировка сборки хранилища между процессами (flock на файле рядом с каталогом):
+    одно хранилище собирает только один процесс, остальные ждут его результата
+    """
+    if fcntl is None:
+        yield
+        return
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    with open(store_dir + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def ensure_store(csv_path, store_dir=None, fingerprint=None):
+    """
+    Возвращает каталог хранилища, пересобирая его только если CSV изменился.
+    Сборка идет под блокировкой: если хранилище уже собирает другой процесс,
+    этот дождется его и пересобирать не станет
+    """
+    store_dir = store_dir or store_path(csv_path)
+    fingerprint = fingerprint or file_fingerprint(csv_path)
+    if _is_current(store_dir, fingerprint):
+        return store_dir
+    with _build_lock(store_dir):
+        if _is_current(store_dir, fingerprint):
+            return store_dir
+        return build_store(csv_path, store_dir, fingerprint)
+
+
+def _is_current(store_dir, fingerprint):
+    try:
+        meta = read_meta(store_dir)
+        return meta['fingerprint'] == fingerprint and meta.get('version') == STORE_VERSION
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def add_calendar(df):
+    """
+    Добавляет к датафрейму целочисленные month, day_of_year и season_number (см. CALENDAR),
+    чтобы не пересчитывать .dt.month и .dt.day при каждом обращении.
+    Для данных из хранилища они посчитаны один раз в build_store
+    """
+    timestamps = df['timestamp']
+    valid = timestamps.notna().to_numpy()
+    month = timestamps.dt.month.fillna(1).to_numpy(dtype=np.int64)
+    day = timestamps.dt.day.fillna(1).to_numpy(dtype=np.int64)
+
+    df['month'] = np.where(valid, month, 0).astype(CALENDAR['month'])
+    df['day_of_year'] = np.where(valid, day_of_year(month, day), -1).astype(CALENDAR['day_of_year'])
+    df['season_number'] = np.where(valid, month % 12 // 3 + 1, 0).astype(CALENDAR['season_number'])
+    return df
+
+
+@metrics.timed('load_data')
+def load_data(csv_path, store_dir=None, fingerprint=None):
+    """
+    Загружает исторические данные через колоночное хранилище вместо pd.read_csv.
+
+    При первом чтении CSV разбирается и сохраняется рядом в типизированном виде,
+    дальше (пока отпечаток CSV не изменился) датафрейм собирается из .npy-файлов
+    как есть - без разбора текста, pd.to_datetime, сортировки и календарных расчетов.
+
+    Строки отсортированы по (город, дата), при равных датах - в порядке CSV.
+    Колонки: city (category), timestamp (datetime64), temperature (float32),
+    season (category), month, day_of_year, season_number (целые, см. CALENDAR)
+    """
+    store_dir = ensure_store(csv_path, store_dir, fingerprint)
+    meta = read_meta(store_dir)
+    columns = attach(store_dir)
+
+    df = pd.DataFrame({
+        'city': pd.Categorical.from_codes(columns['city'], meta['cities']),
+        'timestamp': columns['timestamp'].view('datetime64[ns]'),
+        'temperature': columns['temperature'],
+        'season': pd.Categorical.from_codes(columns['season'], SEASONS),
+        **{name: columns[name] for name in CALENDAR},
+    })
+    metrics.count('rows.loaded', len(df))
+    return df
+
+
+def read_layout(store_dir):
+    """
+    Раскладка CityIndex, сохраненная при сборке хранилища: CityIndex(load_data(...),
+    fingerprint, read_layout(store_dir)) не сортирует и не копирует данные.
+    Перестановка строк подключается через numpy.memmap
+    """
+    meta = read_meta(store_dir)
+    return {
+        'store_dir': store_dir,
+        'cities': meta['cities'],
+        'order': np.load(os.path.join(store_dir, ORDER_FILE), mmap_mode='r'),
+        'offsets': np.asarray(meta['offsets'], dtype=np.int64),
+        'season_stats': np.asarray(meta['season_stats'], dtype=np.float64),
+        'city_stats': np.asarray(meta['city_stats'], dtype=np.float64),
+    }
+
+
+def attach(store_dir):
+    """
+    Подключает колонки через numpy.memmap: данные не копируются, страницы файла
+    разделяются между всеми процессами через page cache
+    """
+    return {
+        name: np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode='r')
+        for name in {**COLUMNS, **CALENDAR}
+    }
+
+
+# колонки, подключенные в процессе-воркере
+_worker_columns = {}
+
+
+def init_worker(store_dir, fingerprint=None):
+    """
+    Инициализатор Pool: каждый воркер один раз подключает хранилище и перестановку по сезонам.
+    fingerprint - отпечаток данных родителя: если хранилище с тех пор пересобрано,
+    analyze_block не станет считать по чужим данным
+    """
+    _worker_columns.update(attach(store_dir))
+    _worker_columns['order'] = np.load(os.path.join(store_dir, ORDER_FILE), mmap_mode='r')
+    _worker_columns['stale'] = fingerprint is not None and read_meta(store_dir)['fingerprint'] != fingerprint
+
+
+def analyze_block(city_name, season, start, stop):
+    """
+    Анализ одного города в сезоне по строкам order[start:stop] подключенных колонок
+    (блок CityIndex, строки в хронологическом порядке).
+    Выполняется в воркере, считает то же, что analyze_all для одной строки:
+    пропуски температуры не входят в count/mean/min/max, строки без даты - в скользящие
+    окна, строки без даты или температуры - в тренд. Возвращает RollingAnalysisResult
+    """
+    if _worker_columns['stale']:
+        raise RuntimeError('Хранилище пересобрано другим процессом, данные нужно загрузить заново')
+    rows = _worker_columns['order'][start:stop]
+    temperature = _worker_columns['temperature'][rows].astype(np.float64)
+    timestamps = _worker_columns['timestamp'][rows]
+
+    # строки без даты стоят в начале блока и в скользящие окна не входят
+    dated = temperature[timestamps != np.iinfo(np.int64).min]
+    rolling_mean, rolling_std = rolling_mean_std(dated, [0, len(dated)], 30, 7)
+    is_anomaly = flag_anomalies(dated, rolling_mean, rolling_std, 2)
+    slope = trend_slope(timestamps, temperature)
+
+    known = temperature[~np.isnan(temperature)]
+    return RollingAnalysisResult(
+        city=city_name,
+        season=season,
+        count=len(known),
+        mean=float(known.mean()) if len(known) else np.nan,
+        min=float(known.min()) if len(known) else np.nan,
+        max=float(known.max()) if len(known) else np.nan,
+        anomalies=int(is_anomaly.sum()),
+        slope=float(slope),
+        trend=trend_label(slope),
+    )
@@ -1,18 +1,28 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import requests
 import datetime
 from io import StringIO
 from streamlit_option_menu import option_menu
 
+from stats_index import CityIndex, bytes_fingerprint
+from columnar import load_data, read_layout, upload_store_path, prune_upload_stores
+from weather_client import WeatherAPIError, fetch_current_weather
+from weather_cache import default_cache
+import dashboard_data
+from downsampling import points_for_width
+from recommend import fetch_temperatures
+from screening import screen, STATUS_ABOVE, STATUS_BELOW, STATUS_UNKNOWN
+import metrics
+
 if 'uploaded_file' not in st.session_state:
     st.session_state['uploaded_file'] = None
 if 'data' not in st.session_state:
     st.session_state['data'] = None
 if 'api_key' not in st.session_state:
     st.session_state['api_key'] = None
+if 'index' not in st.session_state:
+    st.session_state['index'] = None
 
 with st.sidebar:
     selected = option_menu(
@@ -23,6 +33,24 @@ with st.sidebar:
         default_index=0
     )
 
+    cache_stats = default_cache().stats()
+    st.caption(
+        f"Кэш погоды: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов "
+        f"({cache_stats['hit_rate']:.0%}), записей: {cache_stats['size']}"
+    )
+    memo_stats = dashboard_data.store.stats()
+    st.caption(
+        f"Кэш расчетов: {memo_stats['hits']} попаданий, {memo_stats['misses']} промахов "
+        f"({memo_stats['hit_rate']:.0%}), записей: {memo_stats['size']}"
+    )
+
+    # замеры включаются переменной окружения TEMPERATURE_METRICS=1 (см. metrics.py)
+    if metrics.enabled():
+        with st.expander("Замеры"):
+            st.dataframe(metrics.table()[['span', 'count', 'mean', 'max']], hide_index=True)
+            counters = metrics.registry.snapshot()['counters']
+            st.caption(", ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+
 if selected == "Главная":
     st.title("Добро пожаловать в Анализ температур")
     st.write(
@@ -37,8 +65,20 @@ if selected == "Главная":
         st.warning("Пожалуйста, загрузите CSV файл и введите API-ключ, чтобы продолжить.")
         st.stop()
     else:
-        st.session_state['data'] = pd.read_csv(st.session_state['uploaded_file'])
-        st.session_state['data']['timestamp'] = pd.to_datetime(st.session_state['data']['timestamp'], errors='coerce')
+        fingerprint = bytes_fingerprint(st.session_state['uploaded_file'].getvalue())
+        index = st.session_state['index']
+        # индекс пересобирается только если загружен другой файл
+        if index is None or index.fingerprint != fingerprint:
+            # повторная загрузка того же файла читается из колоночного кэша, без разбора CSV
+            with metrics.span('dashboard.load'):
+                st.session_state['data'] = load_data(
+                    st.session_state['uploaded_file'], upload_store_path(fingerprint), fingerprint
+                )
+                st.session_state['index'] = CityIndex(
+                    st.session_state['data'], fingerprint, read_layout(upload_store_path(fingerprint))
+                )
+                # хранилища прошлых загрузок не копятся во временном каталоге
+                prune_upload_stores(fingerprint)
         st.success("Данные успешно загружены!")
 
 if selected == "Анализ":
@@ -48,103 +88,118 @@ if selected == "Анализ":
         st.warning("Нет данных для анализа. Перейдите на страницу 'Главная' для загрузки файла.")
         st.stop()
 
-    data = st.session_state['data']
-    cities = data['city'].unique()
+    index = st.session_state['index']
+    cities = index.cities
     selected_city = st.sidebar.selectbox("Выберите город", cities)
     st.header(f"Анализ температур для города: {selected_city}")
-    city_data = data[data['city'] == selected_city]
+    # все расчеты страницы кэшируются по (отпечаток данных, город, параметры)
+    with metrics.span('dashboard.analysis.data'):
+        city_data = dashboard_data.city_frame(index, selected_city)
+        city_stats = index.stats(selected_city)
 
     # Tabs
     tab1, tab2 = st.tabs(["Обзор", "Графики"])
 
-    with tab1:
+    with tab1, metrics.span('dashboard.analysis.overview'):
         st.subheader("Общая информация")
         st.markdown(
-            f"- **Максимальная температура**: {city_data['temperature'].max():.2f} °C\n"
-            f"- **Минимальная температура**: {city_data['temperature'].min():.2f} °C\n"
-            f"- **Средняя температура**: {city_data['temperature'].mean():.2f} °C"
+            f"- **Максимальная температура**: {city_stats['max']:.2f} °C\n"
+            f"- **Минимальная температура**: {city_stats['min']:.2f} °C\n"
+            f"- **Средняя температура**: {city_stats['mean']:.2f} °C"
         )
 
         selected_season = st.selectbox("Выберите сезон", ["Winter", "Spring", "Summer", "Autumn"])
-        season_mapping = {"Winter": 1, "Spring": 2, "Summer": 3, "Autumn": 4}
-        season_data = city_data[city_data['timestamp'].dt.month % 12 // 3 + 1 == season_mapping[selected_season]]
-        if not season_data.empty:
+        season_stats = index.stats(selected_city, selected_season.lower())
+        if season_stats['count'] > 0:
             st.markdown(
-                f"- **Максимальная температура в сезоне {selected_season}**: {season_data['temperature'].max():.2f} °C\n"
-                f"- **Минимальная температура в сезоне {selected_season}**: {season_data['temperature'].min():.2f} °C\n"
-                f"- **Средняя температура в сезоне {selected_season}**: {season_data['temperature'].mean():.2f} °C"
+                f"- **Максимальная температура в сезоне {selected_season}**: {season_stats['max']:.2f} °C\n"
+                f"- **Минимальная температура в сезоне {selected_season}**: {season_stats['min']:.2f} °C\n"
+                f"- **Средняя температура в сезоне {selected_season}**: {season_stats['mean']:.2f} °C"
             )
         else:
             st.warning("Нет данных для выбранного сезона.")
 
         st.subheader("Текущая температура")
         if st.session_state['api_key']:
-            base_url = "http://api.openweathermap.org/data/2.5/weather?"
-            complete_url = f"{base_url}appid={st.session_state['api_key']}&q={selected_city}"
-            response = requests.get(complete_url)
-
-            if response.status_code == 200:
-                weather_data = response.json()
-                current_temp_k = weather_data['main']['temp']
-                current_temp_c = current_temp_k - 273.15
-
-                st.metric("Текущая температура (°C)", f"{current_temp_c:.2f}")
-                mean_temp = city_data['temperature'].mean()
-                std_temp = city_data['temperature'].std()
-                lower_bound = mean_temp - 2 * std_temp
-                upper_bound = mean_temp + 2 * std_temp
-
-                if current_temp_c < lower_bound:
-                    st.warning("Температура ниже нормы!")
-                elif current_temp_c > upper_bound:
-                    st.warning("Температура выше нормы!")
+            try:
+                # ответы API кэшируются по TTL и общие для всех сессий дашборда
+                with metrics.span('dashboard.analysis.current_temp'):
+                    weather_data = fetch_current_weather(
+                        selected_city, st.session_state['api_key'], cache=default_cache()
+                    )
+                # норма - ожидаемая температура сезонной модели города на момент ответа,
+                # сравнение - как в screen_all_current (без нормы - STATUS_UNKNOWN)
+                current = screen(
+                    {selected_city: weather_data}, dashboard_data.seasonal_models(index), sigma=2
+                ).iloc[0]
+
+                st.metric("Текущая температура (°C)", f"{current['current_temp']:.2f}")
+                if current['status'] == STATUS_UNKNOWN:
+                    st.info("Нормы на сегодня нет: для сезонной модели города слишком мало данных.")
+                else:
+                    st.caption(f"Норма на сегодня: {current['norm_mean']:.2f} ± {2 * current['norm_std']:.2f} °C")
+                    if current['status'] == STATUS_BELOW:
+                        st.warning("Температура ниже нормы!")
+                    elif current['status'] == STATUS_ABOVE:
+                        st.warning("Температура выше нормы!")
+                    else:
+                        st.success("Температура в пределах нормы.")
+            except WeatherAPIError as e:
+                if e.status == 401:
+                    st.error("Некорректный API-ключ.")
+                elif e.status is None:
+                    st.error(f"API недоступен: {e}")
                 else:
-                    st.success("Температура в пределах нормы.")
-            elif response.status_code == 401:
-                st.error("Некорректный API-ключ.")
-            else:
-                st.error(f"Ошибка API: {response.status_code}")
+                    st.error(f"Ошибка API: {e.status}")
+
+    with tab2, metrics.span('dashboard.analysis.charts'):
+        # графики строятся по прореженным данным; чтобы рассмотреть детали,
+        # нужно сузить период - данные за него будут прорежены заново
+        first_day, last_day = dashboard_data.date_range(city_data)
+        start, end = first_day, last_day
+        if first_day < last_day:
+            start, end = st.slider("Период", min_value=first_day, max_value=last_day, value=(first_day, last_day))
+        n_points = points_for_width()
 
-    with tab2:
         st.subheader("Временной ряд температур")
-        time_series_fig = px.line(city_data, x='timestamp', y='temperature', title=f"Температура в городе {selected_city}")
+        line_data = dashboard_data.line_points(index, selected_city, start, end, n_points)
+        time_series_fig = px.line(line_data, x='timestamp', y='temperature', title=f"Температура в городе {selected_city}")
         st.plotly_chart(time_series_fig)
 
         st.subheader("Сезонные профили")
-        city_data['season'] = city_data['timestamp'].dt.month % 12 // 3 + 1
-        seasonal_profile = city_data.groupby('season')['temperature'].agg(['mean', 'std', 'max', 'min']).reset_index()
-        seasonal_profile['season'] = seasonal_profile['season'].replace({1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Autumn'})
+        seasonal_profile = dashboard_data.seasonal_profile(index, selected_city)
         seasonal_fig = px.bar(seasonal_profile, x='season', y='mean', error_y='std', title="Сезонный профиль температуры")
         st.plotly_chart(seasonal_fig)
 
         st.subheader("Аномалии температуры")
-        city_data['rolling_mean'] = city_data['temperature'].rolling(window=30).mean()
-        city_data['rolling_std'] = city_data['temperature'].rolling(window=30).std()
-        city_data['is_anomaly'] = (
-            (city_data['temperature'] > city_data['rolling_mean'] + 2 * city_data['rolling_std']) |
-            (city_data['temperature'] < city_data['rolling_mean'] - 2 * city_data['rolling_std'])
-        )
         anomalies_fig = px.scatter(
-            city_data, x='timestamp', y='temperature', color='is_anomaly',
+            line_data, x='timestamp', y='temperature', color='is_anomaly',
             title="Аномалии температуры"
         )
+        anomalies_fig.add_scatter(x=line_data['timestamp'], y=line_data['baseline'], mode='lines', name="Сезонная норма")
         st.plotly_chart(anomalies_fig)
 
         st.subheader("Гистограмма температур")
-        histogram_fig = px.histogram(city_data, x='temperature', nbins=30, title="Гистограмма температуры")
+        histogram_data = dashboard_data.histogram_points(index, selected_city, start, end)
+        histogram_fig = px.bar(histogram_data, x='temperature', y='count', title="Гистограмма температуры")
+        histogram_fig.update_layout(bargap=0)
         st.plotly_chart(histogram_fig)
 
         st.subheader("Разброс температур")
-        scatter_fig = px.scatter(city_data, x='timestamp', y='temperature', title="Разброс температуры")
+        spread_data = dashboard_data.spread_points(index, selected_city, start, end, n_points)
+        scatter_fig = px.scatter(spread_data, x='timestamp', y='temperature', title="Разброс температуры")
         st.plotly_chart(scatter_fig)
 
         st.subheader("Плотность температур")
-        density_fig = px.density_heatmap(city_data, x='timestamp', y='temperature', title="Плотность температуры")
+        density_data = dashboard_data.density_points(index, selected_city, start, end)
+        density_fig = px.density_heatmap(
+            density_data, x='timestamp', y='temperature', z='count', histfunc='sum',
+            title="Плотность температуры"
+        )
         st.plotly_chart(density_fig)
 
         st.subheader("Средняя температура по дням")
-        city_data['day'] = city_data['timestamp'].dt.date
-        daily_avg = city_data.groupby('day')['temperature'].mean().reset_index()
+        daily_avg = dashboard_data.daily_avg_points(index, selected_city, start, end, n_points)
         daily_avg_fig = px.line(daily_avg, x='day', y='temperature', title="Средняя температура по дням")
         st.plotly_chart(daily_avg_fig)
 
@@ -155,31 +210,31 @@ if selected == "Сравнение":
         st.warning("Нет данных для анализа. Перейдите на страницу 'Главная' для загрузки файла.")
         st.stop()
 
-    data = st.session_state['data']
-    selected_cities = st.sidebar.multiselect("Выберите города для сравнения", data['city'].unique(), default=data['city'].unique()[:2])
-    comparison_data = data[data['city'].isin(selected_cities)]
-
-    st.subheader("Температурные временные ряды")
-    comparison_fig = px.line(comparison_data, x='timestamp', y='temperature', color='city', title="Сравнение температур")
-    st.plotly_chart(comparison_fig)
-
-    st.subheader("Средние температуры")
-    mean_temps = comparison_data.groupby('city')['temperature'].mean().reset_index()
-    mean_fig = px.bar(mean_temps, x='city', y='temperature', title="Средние температуры по городам")
-    st.plotly_chart(mean_fig)
-
-    st.subheader("Аномалии по городам")
-    comparison_data['rolling_mean'] = comparison_data.groupby('city')['temperature'].transform(lambda x: x.rolling(30).mean())
-    comparison_data['rolling_std'] = comparison_data.groupby('city')['temperature'].transform(lambda x: x.rolling(30).std())
-    comparison_data['is_anomaly'] = (
-        (comparison_data['temperature'] > comparison_data['rolling_mean'] + 2 * comparison_data['rolling_std']) |
-        (comparison_data['temperature'] < comparison_data['rolling_mean'] - 2 * comparison_data['rolling_std'])
-    )
-    comparison_anomalies_fig = px.scatter(
-        comparison_data, x='timestamp', y='temperature', color='is_anomaly', symbol='city',
-        title="Аномалии температур по городам"
-    )
-    st.plotly_chart(comparison_anomalies_fig)
+    index = st.session_state['index']
+    selected_cities = st.sidebar.multiselect("Выберите города для сравнения", index.cities, default=index.cities[:2])
+    first_day, last_day = dashboard_data.date_range(dashboard_data.comparison_frame(index, selected_cities, 2))
+    start, end = first_day, last_day
+    if first_day < last_day:
+        start, end = st.slider("Период", min_value=first_day, max_value=last_day, value=(first_day, last_day))
+    with metrics.span('dashboard.comparison.data'):
+        comparison_data = dashboard_data.comparison_points(index, selected_cities, start, end, points_for_width(), 2)
+
+    with metrics.span('dashboard.comparison.charts'):
+        st.subheader("Температурные временные ряды")
+        comparison_fig = px.line(comparison_data, x='timestamp', y='temperature', color='city', title="Сравнение температур")
+        st.plotly_chart(comparison_fig)
+
+        st.subheader("Средние температуры")
+        mean_temps = dashboard_data.city_means(index, selected_cities)
+        mean_fig = px.bar(mean_temps, x='city', y='temperature', title="Средние температуры по городам")
+        st.plotly_chart(mean_fig)
+
+        st.subheader("Аномалии по городам")
+        comparison_anomalies_fig = px.scatter(
+            comparison_data, x='timestamp', y='temperature', color='is_anomaly', symbol='city',
+            title="Аномалии температур по городам"
+        )
+        st.plotly_chart(comparison_anomalies_fig)
 
 if selected == "Куда вам слетать отдохнуть?":
     st.title("Куда вам слетать отдохнуть?")
@@ -188,32 +243,39 @@ if selected == "Куда вам слетать отдохнуть?":
         st.warning("Нет данных для анализа. Перейдите на страницу 'Главная' для загрузки файла.")
         st.stop()
 
-    data = st.session_state['data']
+    index = st.session_state['index']
     st.subheader("Выбор параметров")
     desired_season = st.selectbox("Выберите сезон", ["Winter", "Spring", "Summer", "Autumn"])
     desired_temp = st.slider("Желаемая температура (°C)", min_value=-30, max_value=50, value=(20, 30))
 
-    season_mapping = {"Winter": 1, "Spring": 2, "Summer": 3, "Autumn": 4}
-    filtered_data = data.copy()
-    filtered_data['season'] = filtered_data['timestamp'].dt.month % 12 // 3 + 1
-    filtered_data = filtered_data[filtered_data['season'] == season_mapping[desired_season]]
-    filtered_data = filtered_data[(filtered_data['temperature'] >= desired_temp[0]) & (filtered_data['temperature'] <= desired_temp[1])]
+    top_n = st.slider("Сколько городов показать", min_value=1, max_value=20, value=5)
 
-    if not filtered_data.empty:
-        suggested_city = filtered_data['city'].value_counts().idxmax()
-        st.success(f"Рекомендуемый город: {suggested_city}")
+    # число дней в диапазоне для всех городов - два бинарных поиска по индексу сезона
+    with metrics.span('dashboard.recommend.rank'):
+        ranking = dashboard_data.season_values(index).rank(desired_season, desired_temp[0], desired_temp[1], top_n)
 
-        base_url = "http://api.openweathermap.org/data/2.5/weather?"
-        complete_url = f"{base_url}appid={st.session_state['api_key']}&q={suggested_city}"
-        response = requests.get(complete_url)
+    if not ranking.empty:
+        st.success(f"Рекомендуемый город: {ranking['city'].iloc[0]}")
 
-        if response.status_code == 200:
-            weather_data = response.json()
-            current_temp_k = weather_data['main']['temp']
-            current_temp_c = current_temp_k - 273.15
+        # текущая погода для всех городов списка запрашивается параллельно
+        with metrics.span('dashboard.recommend.current_temp'):
+            current = fetch_temperatures(
+                ranking['city'], st.session_state['api_key'], cache=default_cache()
+            )
+        ranking['current_temp'] = [
+            None if isinstance(current[city], WeatherAPIError) else current[city]
+            for city in ranking['city']
+        ]
+        st.dataframe(
+            ranking.rename(columns={
+                'city': 'Город', 'days': 'Дней в диапазоне', 'total': 'Дней в сезоне',
+                'share': 'Доля дней', 'current_temp': 'Текущая температура (°C)',
+            }).style.format({'Доля дней': '{:.0%}', 'Текущая температура (°C)': '{:.2f}'}, na_rep='—'),
+            hide_index=True,
+        )
 
-            st.metric(f"Текущая температура в {suggested_city} (°C)", f"{current_temp_c:.2f}")
-        else:
-            st.error(f"Ошибка API: {response.status_code}")
+        errors = {city: e for city, e in current.items() if isinstance(e, WeatherAPIError)}
+        if errors:
+            st.error("Ошибка API: " + ", ".join(f"{city} ({e.status})" for city, e in errors.items()))
     else:
-        st.warning("Не найдено городов, соответствующих вашим критериям.")
\ No newline at end of file
+        st.warning("Не найдено городов, соответствующих вашим критериям.")
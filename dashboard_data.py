@@ -0,0 +1,230 @@
+import functools
+import inspect
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from anomalies import SIGMA
+from downsampling import density_grid, downsample, histogram_bins
+from recommend import SeasonValues
+from seasonal_model import get_models, model_path
+
+SEASON_NAMES = {1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Autumn'}
+
+
+class MemoStore:
+    """
+    LRU-хранилище результатов для страниц дашборда.
+
+    Ключ - (имя расчета, отпечаток датасета, параметры), поэтому при переключении
+    вкладок и городов с уже виденными параметрами расчет не повторяется, а загрузка
+    другого файла автоматически дает новые ключи. Живет в модуле и общий для всех
+    сессий процесса Streamlit; счетчики видны через stats()
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        by_name = {}
+        for key in list(self._items):
+            by_name[key[0]] = by_name.get(key[0], 0) + 1
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._items),
+            'entries': by_name,
+        }
+
+
+store = MemoStore()
+
+
+def memoized(name):
+    """
+    Кэширует функцию вида f(index, *params) в store по (name, index.fingerprint, params).
+    Параметры в ключе - со значениями по умолчанию, поэтому f(index, city)
+    и f(index, city, SIGMA) попадают в одну запись.
+    Результаты общие между вызовами - изменять их нельзя
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(index, *args, **kwargs):
+            bound = signature.bind(index, *args, **kwargs)
+            bound.apply_defaults()
+            params = list(bound.arguments.values())[1:]
+            key = (name, index.fingerprint) + tuple(
+                tuple(p) if isinstance(p, list) else p for p in params
+            )
+            return store.get_or_compute(key, lambda: func(*bound.args, **bound.kwargs))
+        return wrapper
+    return decorator
+
+
+@memoized('city_frame')
+def city_frame(index, city):
+    """
+    Строки города в хронологическом порядке (season_number - сезон по месяцу, 1 - зима)
+    """
+    return index.rows(city).sort_values('timestamp', kind='stable')
+
+
+@memoized('seasonal_profile')
+def seasonal_profile(index, city):
+    profile = (
+        city_frame(index, city)
+        .query('season_number > 0')
+        .groupby('season_number')['temperature'].agg(['mean', 'std', 'max', 'min'])
+        .reset_index()
+    )
+    profile.insert(0, 'season', profile.pop('season_number').map(SEASON_NAMES))
+    return profile
+
+
+@memoized('seasonal_models')
+def seasonal_models(index):
+    """
+    Сезонные модели городов для загруженного файла: обучаются один раз и хранятся
+    в каталоге его колоночного хранилища (см. seasonal_model.py)
+    """
+    path = model_path(index.store_dir) if index.store_dir else None
+    return get_models(index.data, index.fingerprint, path)
+
+
+@memoized('city_anomalies')
+def city_anomalies(index, city, sigma=SIGMA):
+    """
+    Строки города с ожидаемой температурой модели (baseline), остатком и флагом аномалии
+    """
+    city_data = city_frame(index, city)
+    return city_data.join(seasonal_models(index).score_frame(city_data, sigma))
+
+
+@memoized('daily_avg')
+def daily_avg(index, city):
+    city_data = city_frame(index, city)
+    return city_data.groupby(city_data['timestamp'].dt.normalize().rename('day'))['temperature'].mean().reset_index()
+
+
+@memoized('comparison')
+def comparison_frame(index, cities, sigma=SIGMA):
+    """
+    Строки выбранных городов (срезы индекса, без маски по всему датасету)
+    с аномалиями относительно модели каждого города
+    """
+    if not cities:
+        return pd.DataFrame(columns=['city', 'timestamp', 'temperature', 'baseline', 'residual', 'zscore', 'is_anomaly'])
+    return pd.concat([city_anomalies(index, city, sigma) for city in cities])
+
+
+def date_range(frame, x='timestamp'):
+    """
+    Первая и последняя дата ряда - границы слайдера периода
+    """
+    if frame.empty:
+        today = pd.Timestamp.today().date()
+        return today, today
+    return frame[x].min().date(), frame[x].max().date()
+
+
+def _window(frame, start, end, x='timestamp'):
+    """
+    Строки с датой в [start, end] включительно; frame отсортирован по x
+    """
+    values = frame[x].to_numpy()
+    lo = values.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+    hi = values.searchsorted((pd.Timestamp(end) + pd.Timedelta(days=1)).to_datetime64(), side='left')
+    return frame.iloc[lo:hi]
+
+
+# Графики строятся по прореженным данным: в браузер уходит не больше n_points точек
+# на ряд (плюс все аномалии), сколько бы лет ни было в файле. При сужении периода
+# прореживание пересчитывается, и на том же числе точек видно больше деталей
+
+@memoized('line_points')
+def line_points(index, city, start, end, n_points):
+    """
+    Ряд города с аномалиями за период, прореженный LTTB; аномалии сохраняются все
+    """
+    return downsample(_window(city_anomalies(index, city), start, end), n_points, keep='is_anomaly')
+
+
+@memoized('spread_points')
+def spread_points(index, city, start, end, n_points):
+    """
+    Точки для графика разброса: min/max по корзинам сохраняет размах температур
+    """
+    return downsample(_window(city_frame(index, city), start, end), n_points, method='minmax')
+
+
+@memoized('density_points')
+def density_points(index, city, start, end):
+    return density_grid(_window(city_frame(index, city), start, end))
+
+
+@memoized('histogram_points')
+def histogram_points(index, city, start, end, bins=30):
+    return histogram_bins(_window(city_frame(index, city), start, end), bins=bins)
+
+
+@memoized('daily_avg_points')
+def daily_avg_points(index, city, start, end, n_points):
+    return downsample(_window(daily_avg(index, city), start, end, x='day'), n_points, x='day')
+
+
+@memoized('comparison_points')
+def comparison_points(index, cities, start, end, n_points, sigma=SIGMA):
+    """
+    Строки выбранных городов за период, каждый город прореживается отдельно
+    """
+    comparison_data = comparison_frame(index, cities, sigma)
+    if comparison_data.empty:
+        return comparison_data
+    in_range = comparison_data['timestamp'].between(
+        pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1), inclusive='left'
+    )
+    return downsample(comparison_data[in_range], n_points, by='city', keep='is_anomaly')
+
+
+@memoized('city_means')
+def city_means(index, cities):
+    return pd.DataFrame({
+        'city': list(cities),
+        'temperature': [index.stats(city)['mean'] for city in cities],
+    })
+
+
+@memoized('season_values')
+def season_values(index):
+    """
+    Отсортированные температуры по (город, сезон) для страницы рекомендаций
+    """
+    return SeasonValues(index.data, index.fingerprint)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+# ширина графика Plotly в Streamlit по умолчанию, пикселей
+CHART_WIDTH = 1200
+
+
+def points_for_width(width=CHART_WIDTH, points_per_pixel=2):
+    """
+    Сколько точек имеет смысл отправлять в браузер для графика шириной width пикселей
+    """
+    return int(width * points_per_pixel)
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: индексы n_out точек, сохраняющих форму ряда.
+    Первая и последняя точки всегда остаются; x должен быть отсортирован
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # вершина треугольника в следующей корзине - ее средняя точка
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = np.nanmean(y[stop:next_stop]) if next_stop > stop else y[-1]
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:stop] - y[prev]) -
+            (x[prev] - x[start:stop]) * (avg_y - y[prev])
+        )
+        prev = start + (int(np.nanargmax(area)) if not np.isnan(area).all() else 0)
+        selected[i + 1] = prev
+    return selected
+
+
+def minmax(y, n_buckets):
+    """
+    Min/max-прореживание: в каждой из n_buckets корзин остаются минимум и максимум
+    """
+    n = len(y)
+    if 2 * n_buckets >= n:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    filled = np.where(np.isnan(y), np.inf, y)
+    order = np.lexsort((filled, bucket))
+    first = order[edges[:-1]]
+    filled = np.where(np.isnan(y), -np.inf, y)
+    order = np.lexsort((filled, bucket))
+    last = order[edges[1:] - 1]
+    return np.unique(np.concatenate([first, last]))
+
+
+def downsample(df, n_points=None, x='timestamp', y='temperature', by=None,
+               keep=None, method='lttb'):
+    """
+    Прореживание датафрейма перед построением графика.
+
+    n_points - точек на ряд (по умолчанию по ширине графика), by - колонка рядов
+    (например, 'city': каждый город прореживается отдельно), keep - булева колонка
+    строк, которые остаются всегда (например, 'is_anomaly').
+    Возвращает подмножество строк df в исходном порядке
+    """
+    n_points = n_points or points_for_width()
+    xs = df[x].to_numpy().astype(np.int64)
+    ys = df[y].to_numpy(dtype=np.float64)
+    if by is None:
+        groups = [np.arange(len(df))]
+    else:
+        groups = df.groupby(by, sort=False, observed=True).indices.values()
+
+    mask = np.zeros(len(df), dtype=bool)
+    for positions in groups:
+        if method == 'lttb':
+            selected = lttb(xs[positions], ys[positions], n_points)
+        else:
+            selected = minmax(ys[positions], n_points // 2)
+        mask[positions[selected]] = True
+    if keep is not None:
+        mask |= df[keep].to_numpy(dtype=bool)
+    return df[mask]
+
+
+def density_grid(df, x='timestamp', y='temperature', x_bins=100, y_bins=50):
+    """
+    Двумерная гистограмма на сервере вместо отправки всех точек в density_heatmap:
+    возвращает центры ячеек и число точек в каждой
+    """
+    xs = df[x].to_numpy().astype(np.int64)
+    ys = df[y].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(ys)
+    counts, x_edges, y_edges = np.histogram2d(xs[valid], ys[valid], bins=[x_bins, y_bins])
+    x_centers = ((x_edges[:-1] + x_edges[1:]) / 2).astype(np.int64).view('datetime64[ns]')
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    grid_x, grid_y = np.meshgrid(x_centers, y_centers, indexing='ij')
+    return pd.DataFrame({x: grid_x.ravel(), y: grid_y.ravel(), 'count': counts.ravel()})
+
+
+def histogram_bins(df, y='temperature', bins=30):
+    """
+    Гистограмма на сервере: центры корзин и число значений в них
+    """
+    values = df[y].to_numpy(dtype=np.float64)
+    counts, edges = np.histogram(values[~np.isnan(values)], bins=bins)
+    return pd.DataFrame({y: (edges[:-1] + edges[1:]) / 2, 'count': counts})
@@ -0,0 +1,223 @@
+"""
+Легковесные замеры этапов анализа и запросов к API.
+
+    with metrics.span('analysis.rolling'):
+        ...
+    metrics.count('rows.analysis', len(df))
+
+По умолчанию выключены: span() возвращает один и тот же пустой контекст, count()
+сразу выходит, так что в горячих местах остается одна проверка флага.
+Включаются переменной окружения TEMPERATURE_METRICS=1 или metrics.enable().
+Если задан TEMPERATURE_METRICS_PATH, замеры включаются и при выходе из процесса
+пишутся в этот файл (.json - JSON, иначе текстовый формат Prometheus)
+"""
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+
+import pandas as pd
+
+_enabled = bool(os.environ.get('TEMPERATURE_METRICS') or os.environ.get('TEMPERATURE_METRICS_PATH'))
+
+
+class Registry:
+    """
+    Накопленные замеры процесса: по каждому span - число вызовов, суммарное,
+    минимальное и максимальное время; счетчики - просто суммы
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            stat = self.spans.get(name)
+            if stat is None:
+                self.spans[name] = [1, seconds, seconds, seconds]
+            else:
+                stat[0] += 1
+                stat[1] += seconds
+                stat[2] = min(stat[2], seconds)
+                stat[3] = max(stat[3], seconds)
+
+    def add(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'spans': {
+                    name: {'count': n, 'total': total, 'mean': total / n, 'min': lo, 'max': hi}
+                    for name, (n, total, lo, hi) in self.spans.items()
+                },
+                'counters': dict(self.counters),
+            }
+
+
+registry = Registry()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start)
+
+    # span можно открывать и в async with (как contextlib.nullcontext у выключенных замеров)
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def span(name):
+    """
+    Контекст, время выполнения которого записывается под именем name
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """
+    Декоратор: каждый вызов функции - span с именем name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Прибавляет value к счетчику name (строки, байты, запросы)
+    """
+    if _enabled:
+        registry.add(name, value)
+
+
+def table():
+    """
+    Замеры в виде датафрейма (span, count, total, mean, max), по убыванию суммарного времени
+    """
+    spans = registry.snapshot()['spans']
+    frame = pd.DataFrame.from_dict(spans, orient='index', columns=['count', 'total', 'mean', 'min', 'max'])
+    return frame.rename_axis('span').reset_index().sort_values('total', ascending=False)
+
+
+def prometheus_text():
+    """
+    Замеры в текстовом формате Prometheus
+    """
+    snapshot = registry.snapshot()
+    lines = ['# TYPE temperature_span_seconds summary']
+    for name, stat in sorted(snapshot['spans'].items()):
+        lines.append(f'temperature_span_seconds_sum{{span="{name}"}} {stat["total"]}')
+        lines.append(f'temperature_span_seconds_count{{span="{name}"}} {stat["count"]}')
+    lines.append('# TYPE temperature_span_seconds_max gauge')
+    for name, stat in sorted(snapshot['spans'].items()):
+        lines.append(f'temperature_span_seconds_max{{span="{name}"}} {stat["max"]}')
+    lines.append('# TYPE temperature_events_total counter')
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append(f'temperature_events_total{{name="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def export(path):
+    """
+    Пишет замеры в файл: .json - JSON, иначе текстовый формат Prometheus
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            json.dump(registry.snapshot(), f, ensure_ascii=False, indent=2)
+        else:
+            f.write(prometheus_text())
+
+
+@contextlib.contextmanager
+def profile(path=None, tool='cprofile', limit=30):
+    """
+    Профилирование одного прогона:
+
+        with metrics.profile('analysis.prof'):
+            analysis('Moscow')
+
+    tool='cprofile' - статистика cProfile в path (.prof, смотреть через snakeviz/pstats)
+    или, без path, top limit функций по cumulative в stdout.
+    tool='pyinstrument' - нужен установленный pyinstrument; отчет HTML в path или текст в stdout
+    """
+    if tool == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            if path:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+            else:
+                print(profiler.output_text())
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        else:
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+
+
+if os.environ.get('TEMPERATURE_METRICS_PATH'):
+    atexit.register(export, os.environ['TEMPERATURE_METRICS_PATH'])
@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from stats_index import SEASONS, month_season_codes
+from weather_client import BASE_URL, WeatherClient
+
+
+class SeasonValues:
+    """
+    Отсортированные температуры для каждой пары (город, сезон по месяцу)
+    для страницы рекомендаций.
+
+    Все значения лежат в одном массиве, отсортированном по (город, сезон, температура).
+    К температуре прибавлен сдвиг номера блока, поэтому массив отсортирован целиком
+    и число дней в диапазоне [lo, hi] для всех городов сразу - это два searchsorted:
+    O(число городов * log(строк)) на запрос вместо копии и прохода по всему датасету
+    """
+
+    def __init__(self, data, fingerprint=None):
+        self.fingerprint = fingerprint
+
+        temperature = data['temperature'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(temperature)
+        city_codes, cities = pd.factorize(data['city'])
+        season_codes = month_season_codes(data)
+        valid &= (city_codes >= 0) & (season_codes >= 0)
+        self.cities = np.asarray(cities, dtype=object)
+
+        blocks = city_codes[valid].astype(np.int64) * len(SEASONS) + season_codes[valid]
+        temperature = temperature[valid]
+        self.low = temperature.min() if len(temperature) else 0.0
+        # ширина блока больше размаха температур: сдвинутые блоки не пересекаются
+        self.span = (temperature.max() - self.low if len(temperature) else 0.0) + 1.0
+
+        self.values = np.sort(blocks * self.span + (temperature - self.low))
+        self.totals = np.bincount(blocks, minlength=len(self.cities) * len(SEASONS)).reshape(
+            len(self.cities), len(SEASONS)
+        )
+
+    def days_in_range(self, season, lo, hi):
+        """
+        Число дней сезона с температурой в [lo, hi] для каждого города (массив по self.cities)
+        """
+        s = SEASONS.index(season.lower())
+        shift = (np.arange(len(self.cities)) * len(SEASONS) + s) * self.span
+        lo, hi = lo - self.low, hi - self.low
+        if hi < max(lo, 0) or lo > self.span - 1:
+            return np.zeros(len(self.cities), dtype=np.int64)
+        lo, hi = max(lo, 0), min(hi, self.span - 1)
+        return (np.searchsorted(self.values, shift + hi, side='right')
+                - np.searchsorted(self.values, shift + lo, side='left'))
+
+    def rank(self, season, lo, hi, top=5):
+        """
+        top городов по доле дней сезона с температурой в [lo, hi]:
+        city, days (дней в диапазоне), total (дней сезона), share
+        """
+        days = self.days_in_range(season, lo, hi)
+        total = self.totals[:, SEASONS.index(season.lower())]
+        share = np.divide(days, total, out=np.zeros(len(days)), where=total > 0)
+
+        found = np.flatnonzero(days > 0)
+        # по убыванию доли, при равной доле - по числу дней
+        found = found[np.lexsort((-days[found], -share[found]))][:top]
+        return pd.DataFrame({
+            'city': self.cities[found],
+            'days': days[found],
+            'total': total[found],
+            'share': share[found],
+        })
+
+
+async def _fetch_all(cities, api_key, base_url, cache):
+    async with WeatherClient(api_key, base_url, cache=cache) as client:
+        return {city: weather async for city, weather in client.fetch_many(cities)}
+
+
+def fetch_temperatures(cities, api_key, base_url=BASE_URL, cache=None):
+    """
+    Текущие температуры (°C) городов, запрошенные параллельно.
+    Для городов, которые получить не удалось, вместо числа - WeatherAPIError
+    """
+    weather = asyncio.run(_fetch_all(list(cities), api_key, base_url, cache))
+    return {
+        city: value if isinstance(value, Exception) else value['main']['temp'] - 273.15
+        for city, value in weather.items()
+    }
@@ -0,0 +1,33 @@
+from screening import STATUS_ABOVE, STATUS_BELOW, STATUS_UNKNOWN
+
+# сообщения current_temp о погоде относительно нормы
+_STATUS_MESSAGES = {
+    STATUS_ABOVE: "Текущая погода выше нормы для текущего сезона",
+    STATUS_BELOW: "Текущая погода ниже нормы для текущего сезона",
+    STATUS_UNKNOWN: "Нет исторической нормы для города на эту дату",
+}
+
+
+def print_analysis(result, tail=5):
+    """
+    Печатает результат analysis() в прежнем виде: статистики сезона и последние строки профиля
+    """
+    print(
+        f"Текущий сезон для города {result.city}: {result.season}\n\n"
+        f"Минимальная температура в сезоне: {result.min}\n"
+        f"Максимальная температура в сезоне: {result.max}\n"
+        f"Средняя температура в сезоне:  {result.mean}\n"
+    )
+    print(f'Профиль текущего сезона города {result.city}')
+    if result.profile is not None:
+        print(result.profile.tail(tail))
+
+
+def print_current_temp(result):
+    """
+    Печатает результат current_temp(): температуру, норму и вывод о ней
+    """
+    print(f"Текущая температура: {result.temp_k} K / {result.temp_c:.2f} °C")
+    print(result.norm_mean)
+    print(result.norm_std)
+    print(_STATUS_MESSAGES.get(result.status, "Погода нормальна для текущего сезона"))
@@ -0,0 +1,69 @@
+from dataclasses import dataclass, field, fields
+
+import pandas as pd
+
+
+@dataclass(slots=True)
+class AnalysisResult:
+    """
+    Результат analysis() для одного города в сезоне: аномалии - отклонения от сезонной
+    модели города (см. seasonal_model.py), тренд - МНК по строкам сезона.
+    profile - строки сезона с baseline, residual, zscore, is_anomaly и trend
+    """
+    city: str
+    season: str
+    count: int
+    mean: float
+    min: float
+    max: float
+    anomalies: int
+    slope: float
+    trend: str
+    profile: pd.DataFrame = field(default=None, repr=False, compare=False, metadata={'column': False})
+
+
+@dataclass(slots=True)
+class RollingAnalysisResult:
+    """
+    Сводка по городу в сезоне по правилу скользящих окон: аномалия - значение вне
+    rolling_mean (30) ± 2 * rolling_std (7). Так считают analyze_all, parallel_analysis
+    (строка на город) и streaming.py - они сверяются друг с другом.
+    count, mean, min, max и тренд те же, что у analysis(), число аномалий - нет
+    """
+    city: str
+    season: str
+    count: int
+    mean: float
+    min: float
+    max: float
+    anomalies: int
+    slope: float
+    trend: str
+
+
+@dataclass(slots=True)
+class CurrentTempResult:
+    """
+    Результат current_temp() / async_current_temp(): текущая температура и норма
+    города на этот момент - ожидаемая температура сезонной модели ± 3 * sigma ее остатка
+    """
+    city: str
+    dt: object
+    temp_k: float
+    temp_c: float
+    norm_mean: float
+    norm_std: float
+    lower: float
+    upper: float
+    status: str
+
+
+def to_frame(results):
+    """
+    Список результатов одного типа -> датафрейм, колонка на поле (без вложенных таблиц)
+    """
+    results = list(results)
+    if not results:
+        return pd.DataFrame()
+    names = [f.name for f in fields(results[0]) if f.metadata.get('column', True)]
+    return pd.DataFrame({name: [getattr(result, name) for result in results] for name in names})
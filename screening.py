@@ -0,0 +1,117 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+
+from weather_client import GROUP_SIZE, WeatherAPIError
+
+STATUS_ABOVE = 'выше нормы'
+STATUS_BELOW = 'ниже нормы'
+STATUS_NORMAL = 'в пределах нормы'
+STATUS_UNKNOWN = 'нет данных'
+
+
+async def fetch_current_all(client, cities, ids, group_size=GROUP_SIZE):
+    """
+    Текущая погода для списка городов минимальным числом запросов.
+
+    Города, id которых уже есть в кэше ids (WeatherCache: название -> id), запрашиваются
+    пачками по group_size через /group. Остальные - по одному через /weather,
+    их id запоминаются, и в следующий раз они тоже идут пачками.
+    Если у клиента есть кэш погоды, свежие ответы берутся из него, а ответы /group
+    в него записываются.
+
+    Кэши читаются и пишутся пачками (get_many/set_many), SQLite - в потоке, не на цикле событий.
+
+    Возвращает dict: город -> ответ в формате /weather или WeatherAPIError
+    """
+    cities = list(dict.fromkeys(cities))
+    weather = {}
+    if client.cache is not None:
+        weather.update(await client.cache.get_many_async(cities))
+    missing = [city for city in cities if city not in weather]
+    known_ids = await ids.get_many_async(missing)
+
+    by_id = {}
+    unresolved = []
+    for city in missing:
+        city_id = known_ids.get(city)
+        if city_id is None:
+            unresolved.append(city)
+        else:
+            # под одним id могут оказаться несколько названий города
+            by_id.setdefault(city_id, []).append(city)
+
+    fresh = {}
+    new_ids = {}
+
+    async def fetch_chunk(chunk):
+        try:
+            found = {item['id']: item for item in await client.fetch_group(chunk)}
+        except WeatherAPIError as e:
+            found, error = {}, e
+        else:
+            error = None
+        for city_id in chunk:
+            for city in by_id[city_id]:
+                item = found.get(city_id)
+                if item is None:
+                    weather[city] = error or WeatherAPIError(404, city, 'нет в ответе /group')
+                    continue
+                weather[city] = fresh[city] = item
+
+    async def resolve(city):
+        try:
+            item = await client.get('weather', {'q': city}, city)
+        except WeatherAPIError as e:
+            weather[city] = e
+            return
+        weather[city] = fresh[city] = item
+        new_ids[city] = item['id']
+
+    known = list(by_id)
+    chunks = [known[i:i + group_size] for i in range(0, len(known), group_size)]
+    await asyncio.gather(*(resolve(city) for city in unresolved), *(fetch_chunk(chunk) for chunk in chunks))
+
+    await ids.set_many_async(new_ids)
+    if client.cache is not None:
+        await client.cache.set_many_async(fresh)
+    return {city: weather[city] for city in cities}
+
+
+def screen(weather, norms, sigma=3):
+    """
+    Сравнение текущей погоды с климатической нормой для всех городов сразу.
+
+    weather - результат fetch_current_all. norms - источник нормы с методом norms(cities, dates)
+    (seasonal_model.SeasonalModels): норма на момент ответа (UTC) берется одним векторным
+    обращением, границы - mean ± sigma * std.
+    Возвращает датафрейм: city, dt, current_temp (°C), norm_mean, norm_std, lower, upper,
+    status и error (текст ошибки API, если погоду получить не удалось)
+    """
+    cities = list(weather)
+    ok = [not isinstance(weather[city], Exception) for city in cities]
+    current = np.array([weather[c]['main']['temp'] - 273.15 if f else np.nan for c, f in zip(cities, ok)])
+    dt = pd.to_datetime([weather[c]['dt'] if f else None for c, f in zip(cities, ok)], unit='s')
+
+    norm_mean, norm_std = norms.norms(cities, dt)
+    lower = norm_mean - sigma * norm_std
+    upper = norm_mean + sigma * norm_std
+    # сравнения с NaN ложны, поэтому города без нормы или погоды получают STATUS_UNKNOWN
+    status = np.select(
+        [current > upper, current < lower, (current >= lower) & (current <= upper)],
+        [STATUS_ABOVE, STATUS_BELOW, STATUS_NORMAL],
+        STATUS_UNKNOWN,
+    )
+
+    return pd.DataFrame({
+        'city': cities,
+        'dt': dt,
+        'current_temp': current,
+        'norm_mean': norm_mean,
+        'norm_std': norm_std,
+        'lower': lower,
+        'upper': upper,
+        'status': status,
+        'error': [None if f else str(weather[c]) for c, f in zip(cities, ok)],
+    })
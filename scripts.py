@@ -1,104 +1,255 @@
 import pandas as pd
 import numpy as np
 
-import requests
-import json
+import os
 import datetime
-import aiohttp
+import asyncio
 
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import OneHotEncoder
+from multiprocessing import Pool
+
+from stats_index import SEASONS, _SLOTS, get_index, file_fingerprint, season_codes, trend_slope, trend_label
+from columnar import read_meta, read_layout, load_data, init_worker, analyze_block, store_path
+from weather_client import BASE_URL, WeatherClient, fetch_current_weather
+from weather_cache import default_cache, city_id_cache
+from seasonal_model import get_models, model_path
+from anomalies import rolling_anomalies
+from screening import fetch_current_all, screen, STATUS_ABOVE, STATUS_BELOW, STATUS_NORMAL, STATUS_UNKNOWN
+import metrics
+from results import AnalysisResult, CurrentTempResult, to_frame
+from reporting import print_analysis, print_current_temp
+
+DATA_PATH = 'temperature_data.csv'
+
+# ключ OpenWeatherMap берется только из окружения, запросы без него не отправляются (см. require_api_key)
+api_key = os.environ.get('OPENWEATHER_API_KEY')
+# можно направить на локальную заглушку (см. stub_server.py)
+base_url = os.environ.get('OPENWEATHER_BASE_URL', BASE_URL)
+
+# после первого запуска данные читаются из типизированного колоночного кэша рядом с CSV
+fingerprint = file_fingerprint(DATA_PATH)
+data = load_data(DATA_PATH, fingerprint=fingerprint)
+# индекс по городам и сезонам посчитан при сборке хранилища и только подключается
+index = get_index(data, fingerprint, read_layout(store_path(DATA_PATH)))
 
-data = pd.read_csv('temperature_data.csv')
-data['timestamp'] = pd.to_datetime(data['timestamp'], errors='coerce')
-    
-def analysis(city_name):
 
+def require_api_key():
     """
-    Принимает на вход название города
+    Ключ OpenWeatherMap для запросов к API; если OPENWEATHER_API_KEY не задан - RuntimeError
+    """
+    if not api_key:
+        raise RuntimeError('Не задан ключ OpenWeatherMap: укажите его в переменной окружения OPENWEATHER_API_KEY')
+    return api_key
 
-    Проводит анализ временного ряда температуры для выбранного города и выдает:
-      1. mean, min, max температуры за весь период (по нынешнему сезону)
-      2. Строит скользящие mean, std
-      3. Ищет аномалии на основе (rolling_mean ± sigma * rolling_std)
-      4. Составляет сезонный профиль (mean и std по сезонам)
-      5. Находит тренд (линейная регрессия): положительный или отрицательный
 
+def seasonal_models():
+    """
+    Сезонные модели городов (см. seasonal_model.py): обучаются один раз и хранятся
+    рядом с колоночным хранилищем CSV, пока CSV не изменился
     """
+    return get_models(data, index.fingerprint, model_path(store_path(DATA_PATH)))
 
-    data_copy = data.copy()
-    # я решил, что нужен текущий сезон - то есть на дату запроса пользователя 
+
+def get_current_season():
+    """
+    Сезон на дату запроса пользователя
+    """
     current_month = datetime.datetime.now().month
 
     if current_month in [12, 1, 2]:
-        current_season = 'winter'
+        return 'winter'
     elif current_month in [3, 4, 5]:
-        current_season = 'spring'
+        return 'spring'
     elif current_month in [6, 7, 8]:
-        current_season = 'summer'
+        return 'summer'
     else:
-        current_season = 'autumn'
-
-    city_season_df = data_copy.loc[
-        (data_copy['season'] == current_season) &
-        (data_copy['city'] == city_name)
-    ].copy()
-
-    min_temp = city_season_df['temperature'].min()
-    max_temp = city_season_df['temperature'].max()
-    mean_temp = city_season_df['temperature'].mean()
-
-    print(
-        f"Текущий сезон для города {city_name}: {current_season}\n\n"
-        f"Минимальная температура в сезоне: {min_temp}\n"
-        f"Максимальная температура в сезоне: {max_temp}\n"
-        f"Средняя температура в сезоне:  {mean_temp}\n"
+        return 'autumn'
+
+    
+def analysis(city_name, verbose=False):
+
+    """
+    Принимает на вход название города (и verbose=True, чтобы напечатать результат)
+
+    Проводит анализ временного ряда температуры для выбранного города и выдает:
+      1. mean, min, max температуры за весь период (по нынешнему сезону)
+      2. Ожидаемую температуру по сезонной модели города (тренд + годовые гармоники)
+      3. Ищет аномалии: |температура - модель| > 2 * sigma остатка города
+      4. Тренд сезона - МНК-наклон по строкам сезона (как в analyze_all): положительный или отрицательный
+
+    Модели обучаются один раз по всей истории (см. seasonal_model.py), здесь только
+    одно векторное вычисление остатков для строк сезона
+
+    Возвращает AnalysisResult (см. results.py); печать - в reporting.print_analysis
+    """
+
+    # я решил, что нужен текущий сезон - то есть на дату запроса пользователя 
+    current_season = get_current_season()
+
+    # строки города в сезоне - непрерывный срез индекса, статистики посчитаны заранее
+    with metrics.span('analysis.select'):
+        city_season_df = index.rows(city_name, current_season).copy()
+        season_stats = index.stats(city_name, current_season)
+    metrics.count('rows.analysis', len(city_season_df))
+
+    with metrics.span('analysis.score'):
+        models = seasonal_models()
+        city_season_df[['baseline', 'residual', 'zscore', 'is_anomaly']] = models.score_frame(
+            city_season_df, sigma=2
+        )
+
+    # без строк в сезоне (или с одной датой) наклон - NaN, тренда нет
+    slope = trend_slope(city_season_df['timestamp'].to_numpy(), city_season_df['temperature'].to_numpy())
+    trend_value = trend_label(slope)
+    city_season_df['trend'] = trend_value
+
+    result = AnalysisResult(
+        city=city_name,
+        season=current_season,
+        count=int(season_stats['count']),
+        mean=float(season_stats['mean']),
+        min=float(season_stats['min']),
+        max=float(season_stats['max']),
+        anomalies=int(city_season_df['is_anomaly'].sum()),
+        slope=float(slope),
+        trend=trend_value,
+        profile=city_season_df,
     )
+    if verbose:
+        print_analysis(result)
+    return result
 
-    city_season_df['rolling_mean'] = city_season_df.groupby(
-        'city')['temperature'].rolling(window=30).mean().reset_index(level=0, drop=True)
+@metrics.timed('analyze_all')
+def analyze_all(data, season=None):
+    """
+    Сводка сразу по всем городам за один векторизованный проход по скользящим окнам
+    (без обученных моделей - сверяется с parallel_analysis и streaming.py)
 
-    city_season_df['rolling_std'] = city_season_df.groupby(
-        'city')['temperature'].rolling(window=7).std().reset_index(level=0, drop=True)
+    Для выбранного сезона (по умолчанию текущего) считает по каждому городу:
+      1. count, mean, min, max температуры
+      2. скользящие mean (30) и std (7) по строкам с датой, число аномалий (rolling_mean ± 2 * rolling_std)
+      3. наклон тренда - МНК в замкнутой форме по группам, без LinearRegression на каждый город
 
-    city_season_df['is_anomaly'] = (
-        (city_season_df['temperature'] > city_season_df['rolling_mean'] + 2 * city_season_df['rolling_std']) |
-        (city_season_df['temperature'] < city_season_df['rolling_mean'] - 2 * city_season_df['rolling_std'])
+    count, mean, min, max и тренд совпадают с analysis(), аномалии - нет: analysis
+    ищет их относительно сезонной модели города.
+    Возвращает датафрейм: одна строка на город (поля RollingAnalysisResult)
+    """
+    if season is None:
+        season = get_current_season()
+
+    # сравнение кодов категориальной колонки вместо сравнения строк
+    df = data.loc[season_codes(data) == SEASONS.index(season), ['city', 'timestamp', 'temperature']]
+    df = df.reset_index(drop=True)
+    df['temperature'] = df['temperature'].astype(np.float64)
+    metrics.count('rows.analyze_all', len(df))
+    by_city = df.groupby('city', sort=False, observed=True)
+
+    # в скользящие окна идут только строки с датой: без нее место строки в ряду неизвестно
+    # (в хранилище такие строки стоят в начале города, в CSV - где угодно)
+    dated = df['timestamp'].notna()
+    df['is_anomaly'] = rolling_anomalies(
+        df[dated], by='city', mean_window=30, std_window=7, sigma=2
+    )['is_anomaly'].reindex(df.index, fill_value=False)
+
+    # наклон = sum((x - x_mean) * (y - y_mean)) / sum((x - x_mean) ** 2) внутри каждого города,
+    # в регрессию входят только строки, где есть и дата, и температура (как в stats_index.trend_slope)
+    paired = df['timestamp'].notna() & df['temperature'].notna()
+    timestamps = df['timestamp'].where(paired)
+    x = (timestamps - timestamps.groupby(df['city'], sort=False, observed=True).transform('min')).dt.days
+    dx = x - x.groupby(df['city'], sort=False, observed=True).transform('mean')
+    dy = df['temperature'] - by_city['temperature'].transform('mean')
+    sums = pd.DataFrame({'sxy': dx * dy, 'sxx': dx * dx}).groupby(df['city'], sort=False, observed=True).sum()
+    slope = sums['sxy'] / sums['sxx']
+
+    result = by_city['temperature'].agg(['count', 'mean', 'min', 'max'])
+    result['anomalies'] = by_city['is_anomaly'].sum()
+    result['slope'] = slope
+    result['trend'] = np.select(
+        [result['slope'] > 0, result['slope'] < 0],
+        ['Положительный тренд', 'Отрицательный тренд'],
+        'Нет явного тренда'
     )
+    result.insert(0, 'season', season)
+    return result.reset_index()
 
-    # Для изучения тренда
-
-    city_season_df['days_from_start'] = (
-        city_season_df['timestamp'] - city_season_df['timestamp'].min()
-    ).dt.days
-
-    X = city_season_df[['days_from_start']]
-    y = city_season_df['temperature']
-    model = LinearRegression()
-    model.fit(X, y)
-    slope = model.coef_[0]
-  
-    if slope > 0:
-        trend_value = 'Положительный тренд'
-    elif slope < 0:
-        trend_value = 'Отрицательный тренд'
-    else:
-        trend_value = 'Нет явного тренда'
 
-    city_season_df['trend'] = trend_value
-    city_season_df.drop(columns='days_from_start', inplace=True)
-    print(f'Профиль текущего сезона города {city_name}')
-    print(city_season_df.tail(5))
+@metrics.timed('parallel_analysis')
+def parallel_analysis(cities, season=None, processes=None):
+    """
+    analyze_all для списка городов в пуле процессов (правило скользящих окон,
+    см. RollingAnalysisResult)
+
+    Воркеры не читают CSV и не держат свою копию датафрейма: каждый воркер подключает
+    через numpy.memmap то же колоночное хранилище (см. columnar.py), из которого
+    загружены data и index, а родитель передает только город и смещения блока.
+    Хранилище здесь не пересобирается: если CSV изменился, результат все равно
+    относится к загруженным данным, как у analysis и analyze_all.
+    Возвращает датафрейм в том же виде, что и analyze_all
+    """
+    if season is None:
+        season = get_current_season()
+
+    store_dir = index.store_dir
+    if read_meta(store_dir)['fingerprint'] != index.fingerprint:
+        raise RuntimeError(f'Хранилище {store_dir} пересобрано другим процессом, данные нужно загрузить заново')
+    offsets = index.offsets
+    s = SEASONS.index(season)
+
+    tasks = []
+    for city in cities:
+        block = index.city_pos[city] * _SLOTS + s
+        # город без строк в сезоне пропускается, как в analyze_all
+        if offsets[block] < offsets[block + 1]:
+            tasks.append((city, season, int(offsets[block]), int(offsets[block + 1])))
+    metrics.count('rows.parallel_analysis', sum(stop - start for _, _, start, stop in tasks))
+
+    # воркеры возвращают RollingAnalysisResult - в родителя передаются только числа
+    with Pool(processes, initializer=init_worker, initargs=(store_dir, index.fingerprint)) as pool:
+        results = pool.starmap(analyze_block, tasks)
 
-def parallel_analysis(cities):
+    return to_frame(results)
+
+
+def compare_with_norm(cityname, x):
     """
-    Параллельный запуск анализа для списка городов
+    Сравнивает ответ OpenWeatherMap с исторической нормой города на тот же день и месяц.
+    Норма - ожидаемая температура сезонной модели города на этот момент и sigma ее
+    остатка, берется из сохраненных коэффициентов за O(1).
+    Возвращает CurrentTempResult
     """
-    with Pool() as pool:
-        pool.map(analysis, cities)
+    converted_dt = datetime.datetime.utcfromtimestamp(x['dt'])
+    with metrics.span('current_temp.norm'):
+        norm_mean, norm_std = seasonal_models().norms([cityname], [converted_dt])
+        norm_mean, norm_std = norm_mean[0], norm_std[0]
+
+    current_temp_c = x['main']['temp'] - 273.15
+
+    upper_bound = norm_mean + 3 * norm_std
+    lower_bound = norm_mean - 3 * norm_std
+
+    if current_temp_c > upper_bound:
+        status = STATUS_ABOVE
+    elif current_temp_c < lower_bound:
+        status = STATUS_BELOW
+    elif lower_bound <= current_temp_c <= upper_bound:
+        status = STATUS_NORMAL
+    else:
+        # нормы для города на эту дату нет (NaN)
+        status = STATUS_UNKNOWN
+
+    return CurrentTempResult(
+        city=cityname,
+        dt=converted_dt,
+        temp_k=x['main']['temp'],
+        temp_c=current_temp_c,
+        norm_mean=float(norm_mean),
+        norm_std=float(norm_std),
+        lower=float(lower_bound),
+        upper=float(upper_bound),
+        status=status,
+    )
 
 
-def current_temp(cityname):
+def current_temp(cityname, verbose=False, cached=True):
     
     """
     Получает текущую погоду для указанного города через OpenWeatherMap API и 
@@ -109,111 +260,90 @@ def current_temp(cityname):
     1. Формирует URL-запрос к OpenWeatherMap, используя API-ключ и название города.
     2. Получает JSON-ответ и извлекает из него текущую температуру (в Кельвинах).
     3. Переводит температуру в градусы Цельсия и выводит оба значения (K и °C).
-    4. Определяет дату из ответа (только число и месяц), находит в датафрейме `data` (глобальная переменная)
-       соответствующие исторические записи для того же города и дня-месяца, но без аномальных дней.
-    5. Расчитывает «верхнюю» и «нижнюю» границы нормы (Mean ± 2 * Std) на основе столбца `rolling_mean` 
-       (сглаженное среднее) из `same_day_month_df`.
+    4. Определяет дату из ответа и берет из сезонной модели города (см. seasonal_model.py,
+       обучается один раз по `data`) ожидаемую температуру на этот момент и sigma остатка.
+    5. Расчитывает «верхнюю» и «нижнюю» границы нормы (Mean ± 3 * Std).
     6. Сравнивает текущую температуру с вычисленными границами и выводит, выше ли она нормы, ниже нормы 
        или находится в пределах нормы.
 
     Принимает: название города, для которого нужно получить текущую температуру
         и провести сравнение с историческими данными
 
-    Возвращает: функция выводит результаты и ничего не возвращает
+    Возвращает: CurrentTempResult (см. results.py); с verbose=True результат еще и печатается.
+    cached=False - запрос к API в обход кэша погоды (например, для замеров)
 
     Основа запроса с API: https://www.geeksforgeeks.org/python-find-current-weather-of-any-city-using-openweathermap-api/
 
     Докстринг сгенерирован GPT4
     """
  
-    base_url = "http://api.openweathermap.org/data/2.5/weather?"
-  
-    complete_url = base_url + "appid=" + api_key + "&q=" + cityname
- 
-    response = requests.get(complete_url)
-    x = response.json()
-
-    raw_dt = x['dt']
-    converted_dt = datetime.datetime.utcfromtimestamp(raw_dt)  
-    converted_date_str = converted_dt.strftime('%Y-%m-%d')
-
-    same_day_month_df = data[
-        (data['timestamp'].dt.day == converted_dt.day) &
-        (data['timestamp'].dt.month == converted_dt.month) &
-        (data['city'] == cityname)
-    ].copy()
-
-
-    same_day_month_df['rolling_mean'] = data.groupby('city')['temperature'].rolling(window=30).mean().reset_index(level=0, drop=True)
-    same_day_month_df['rolling_std'] = data.groupby('city')['temperature'].rolling(window=7).std().reset_index(level=0, drop=True)
-
-    print(f"Текущая температура: {x['main']['temp']} K / {x['main']['temp'] - 273.15:.2f} °C")
-    print(same_day_month_df['rolling_mean'].mean())
-    print(same_day_month_df['rolling_mean'].std())
-
-    current_temp_c = x['main']['temp'] - 273.15
+    # общая keep-alive сессия с таймаутом и повторами на 429/5xx, ответы кэшируются по TTL
+    with metrics.span('current_temp.fetch'):
+        x = fetch_current_weather(cityname, require_api_key(), base_url, cache=default_cache() if cached else None)
 
-    upper_bound = same_day_month_df['rolling_mean'].mean() + 3 * same_day_month_df['rolling_mean'].std()
-    lower_bound = same_day_month_df['rolling_mean'].mean() - 3 * same_day_month_df['rolling_mean'].std()
+    result = compare_with_norm(cityname, x)
+    if verbose:
+        print_current_temp(result)
+    return result
 
-    if current_temp_c > upper_bound:
-        print("Текущая погода выше нормы для текущего сезона")
-    elif current_temp_c < lower_bound:
-        print("Текущая погода ниже нормы для текущего сезона")
-    else:
-        print("Погода нормальна для текущего сезона")
-
-async def async_current_temp(cityname):
+async def async_current_temp(cityname, client=None, verbose=False):
     
     """
     
-    Асинхронная версия функции current_temp
+    Асинхронная версия функции current_temp, возвращает CurrentTempResult
+
+    client - общий WeatherClient; без него на вызов открывается свой клиент
     
     """
 
-    api_key = "b7afd6b1373d8c63689dbc1c096c69ae"
- 
-    base_url = "http://api.openweathermap.org/data/2.5/weather?"
-  
-    complete_url = base_url + "appid=" + api_key + "&q=" + cityname
- 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(complete_url) as response:
-            x = await response.json()
+    with metrics.span('async_current_temp.fetch'):
+        if client is None:
+            async with WeatherClient(require_api_key(), base_url, cache=default_cache()) as client:
+                x = await client.fetch(cityname)
+        else:
+            x = await client.fetch(cityname)
 
-    raw_dt = x['dt']
-    converted_dt = datetime.datetime.utcfromtimestamp(raw_dt)  
-    converted_date_str = converted_dt.strftime('%Y-%m-%d')
-
-    same_day_month_df = data[
-        (data['timestamp'].dt.day == converted_dt.day) &
-        (data['timestamp'].dt.month == converted_dt.month) &
-        (data['city'] == cityname)
-    ].copy()
+    result = compare_with_norm(cityname, x)
+    if verbose:
+        print_current_temp(result)
+    return result
 
+async def process_cities(city_list):
+    """
+    Асинхронная обработка списка городов через один общий клиент.
+    Возвращает датафрейм результатов (строка на город, см. CurrentTempResult)
+    """
+    async with WeatherClient(require_api_key(), base_url, cache=default_cache()) as client:
+        tasks = [async_current_temp(city, client) for city in city_list]
+        return to_frame(await asyncio.gather(*tasks))
 
-    same_day_month_df['rolling_mean'] = data.groupby('city')['temperature'].rolling(window=30).mean().reset_index(level=0, drop=True)
-    same_day_month_df['rolling_std'] = data.groupby('city')['temperature'].rolling(window=7).std().reset_index(level=0, drop=True)
 
-    print(f"Текущая температура: {x['main']['temp']} K / {x['main']['temp'] - 273.15:.2f} °C")
-    print(same_day_month_df['rolling_mean'].mean())
-    print(same_day_month_df['rolling_mean'].std())
+async def async_screen_all_current(cities, sigma=3, cached=True):
+    """
+    Асинхронная версия screen_all_current
+    """
+    async with WeatherClient(require_api_key(), base_url, cache=default_cache() if cached else None) as client:
+        with metrics.span('screen_all_current.fetch'):
+            weather = await fetch_current_all(client, cities, city_id_cache())
+    with metrics.span('screen_all_current.compare'):
+        return screen(weather, seasonal_models(), sigma)
 
-    current_temp_c = x['main']['temp'] - 273.15
 
-    upper_bound = same_day_month_df['rolling_mean'].mean() + 3 * same_day_month_df['rolling_mean'].std()
-    lower_bound = same_day_month_df['rolling_mean'].mean() - 3 * same_day_month_df['rolling_mean'].std()
+@metrics.timed('screen_all_current')
+def screen_all_current(cities=None, sigma=3, cached=True):
+    """
+    Проверка "аномальна ли погода сейчас" сразу для всех городов (по умолчанию - всех из данных)
 
-    if current_temp_c > upper_bound:
-        print("Текущая погода выше нормы для текущего сезона")
-    elif current_temp_c < lower_bound:
-        print("Текущая погода ниже нормы для текущего сезона")
-    else:
-        print("Погода нормальна для текущего сезона")
+    Вместо запроса и сравнения на каждый город (current_temp):
+    1. id городов берутся из кэша (city_id_cache), неизвестные города запрашиваются
+       через /weather один раз, и их id запоминаются
+    2. погода остальных городов запрашивается пачками по 20 id через /group
+    3. все ответы сравниваются с климатической нормой (mean ± sigma * std) за один проход
 
-async def process_cities(city_list, data):
-    """
-    Асинхронная обработка списка городов
+    Возвращает датафрейм: город, текущая температура (°C), норма, границы и статус
+    (см. screening.screen). cached=False - погода запрашивается в обход кэша погоды
+    (id городов по-прежнему берутся из city_id_cache)
     """
-    tasks = [current_temp(city, data) for city in city_list]
-    await asyncio.gather(*tasks)
+    if cities is None:
+        cities = index.cities
+    return asyncio.run(async_screen_all_current(list(cities), sigma, cached))
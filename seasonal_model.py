@@ -0,0 +1,201 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from anomalies import SIGMA
+
+# число гармоник годового цикла и длина года в днях
+HARMONICS = 3
+YEAR_DAYS = 365.2425
+NS_PER_DAY = 86_400 * 10**9
+
+MODEL_FILE = 'seasonal_model.npz'
+
+
+def model_path(store_dir):
+    """
+    Файл моделей в каталоге колоночного хранилища (см. columnar.store_path / upload_store_path)
+    """
+    return os.path.join(store_dir, MODEL_FILE)
+
+
+def design(days, harmonics=HARMONICS):
+    """
+    Матрица признаков: 1, время в годах и гармоники годового цикла cos/sin(2πk·t)
+    """
+    years = np.asarray(days, dtype=np.float64) / YEAR_DAYS
+    X = np.empty((len(years), 2 + 2 * harmonics))
+    X[:, 0] = 1.0
+    X[:, 1] = years
+    if harmonics:
+        angle = 2 * np.pi * years
+        cos1, sin1 = np.cos(angle), np.sin(angle)
+        X[:, 2], X[:, 3] = cos1, sin1
+        # старшие гармоники по формулам сложения, без лишних cos/sin
+        for k in range(2, harmonics + 1):
+            cos_prev, sin_prev = X[:, 2 * k - 2], X[:, 2 * k - 1]
+            X[:, 2 * k] = cos_prev * cos1 - sin_prev * sin1
+            X[:, 2 * k + 1] = sin_prev * cos1 + cos_prev * sin1
+    return X
+
+
+class SeasonalModels:
+    """
+    Сезонная модель температуры для каждого города: линейный тренд плюс гармоники
+    годового цикла, остаток - нормальный шум со своим sigma у города.
+
+    Модели обучаются один раз по всей истории (один векторный проход: суммы X^T X
+    и X^T y по городам через bincount и пакетное решение нормальных уравнений)
+    и хранятся компактно - (2 + 2 * harmonics) коэффициентов и sigma на город.
+    Оценка точек - одно векторное вычисление остатков, без пересчета по истории
+    """
+
+    def __init__(self, cities, coef, sigma, count, origin, harmonics=HARMONICS, fingerprint=None):
+        self.cities = list(cities)
+        self.city_pos = {city: i for i, city in enumerate(self.cities)}
+        self.coef = coef
+        self.sigma = sigma
+        self.count = count
+        self.origin = int(origin)
+        self.harmonics = harmonics
+        self.fingerprint = fingerprint
+
+    @classmethod
+    @metrics.timed('seasonal_model.fit')
+    def fit(cls, data, fingerprint=None, harmonics=HARMONICS):
+        city_codes, cities = pd.factorize(data['city'])
+        timestamps = data['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        temperature = data['temperature'].to_numpy(dtype=np.float64)
+        valid = (city_codes >= 0) & ~np.isnan(temperature) & ~pd.isna(data['timestamp']).to_numpy()
+
+        codes = city_codes[valid]
+        origin = timestamps[valid].min() if valid.any() else 0
+        X = design((timestamps[valid] - origin) / NS_PER_DAY, harmonics)
+        y = temperature[valid]
+        n_cities, p = len(cities), X.shape[1]
+
+        xtx = np.empty((n_cities, p, p))
+        xty = np.empty((n_cities, p))
+        for i in range(p):
+            xty[:, i] = np.bincount(codes, X[:, i] * y, minlength=n_cities)
+            for j in range(i, p):
+                xtx[:, i, j] = xtx[:, j, i] = np.bincount(codes, X[:, i] * X[:, j], minlength=n_cities)
+        # псевдообратная вместо solve: у городов с короткой историей матрица вырождена
+        coef = np.einsum('cij,cj->ci', np.linalg.pinv(xtx), xty)
+
+        residual = y - np.einsum('ij,ij->i', X, coef[codes])
+        count = np.bincount(codes, minlength=n_cities)
+        sse = np.bincount(codes, residual ** 2, minlength=n_cities)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma = np.sqrt(sse / (count - p))
+        sigma[count <= p] = np.nan
+
+        metrics.count('rows.seasonal_model', len(y))
+        return cls(cities, coef, sigma, count, origin, harmonics, fingerprint)
+
+    def _positions(self, cities):
+        """
+        Номера городов в моделях, -1 - неизвестный город.
+        Для категориальной колонки (см. columnar.load_data) - по кодам, без сравнения строк
+        """
+        if isinstance(getattr(cities, 'dtype', None), pd.CategoricalDtype):
+            lookup = np.array([self.city_pos.get(city, -1) for city in cities.cat.categories] + [-1])
+            return lookup[cities.cat.codes.to_numpy()]
+        return pd.Categorical(np.asarray(cities, dtype=object), categories=self.cities).codes.astype(np.int64)
+
+    def _baseline(self, pos, timestamps):
+        if getattr(timestamps, 'dtype', None) is None or timestamps.dtype.kind != 'M':
+            timestamps = pd.to_datetime(timestamps)
+        ns = np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+        X = design((ns - self.origin) / NS_PER_DAY, self.harmonics)
+        value = np.einsum('ij,ij->i', X, self.coef[pos])
+        return np.where((pos < 0) | (ns == np.iinfo(np.int64).min), np.nan, value)
+
+    def baseline(self, cities, timestamps):
+        """
+        Ожидаемая температура для пар (город, дата); для неизвестных городов - NaN
+        """
+        return self._baseline(self._positions(cities), timestamps)
+
+    def norms(self, cities, dates):
+        """
+        (ожидаемая температура, sigma остатка) для пар (город, дата) - норма для current_temp
+        и screening.screen
+        """
+        pos = self._positions(cities)
+        return self._baseline(pos, dates), np.where(pos < 0, np.nan, self.sigma[pos])
+
+    def score(self, cities, timestamps, temperature, sigma=SIGMA):
+        """
+        Остатки точек относительно модели: baseline, residual, zscore и is_anomaly
+        (|residual| > sigma * sigma города)
+        """
+        expected, scale = self.norms(cities, timestamps)
+        residual = np.asarray(temperature, dtype=np.float64) - expected
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = residual / scale
+        return pd.DataFrame({
+            'baseline': expected,
+            'residual': residual,
+            'zscore': zscore,
+            'is_anomaly': np.abs(zscore) > sigma,
+        })
+
+    def score_frame(self, df, sigma=SIGMA):
+        """
+        score для строк датафрейма (city, timestamp, temperature), выровненный по df.index
+        """
+        scores = self.score(df['city'], df['timestamp'], df['temperature'], sigma)
+        scores.index = df.index
+        return scores
+
+    def save(self, path):
+        meta = {'fingerprint': self.fingerprint, 'harmonics': self.harmonics, 'origin': self.origin}
+        # запись во временный файл и переименование: недописанная модель не читается
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, cities=np.array(self.cities, dtype=str), coef=self.coef,
+                     sigma=self.sigma, count=self.count, meta=np.array(json.dumps(meta)))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f['meta']))
+            return cls(f['cities'].tolist(), f['coef'], f['sigma'], f['count'], meta['origin'],
+                       meta['harmonics'], meta['fingerprint'])
+
+
+_models_cache = {}
+
+
+def get_models(data, fingerprint, path=None):
+    """
+    Модели для данных с заданным отпечатком: из памяти процесса, из файла path
+    (если он для тех же данных) или, в крайнем случае, обученные заново и сохраненные в path
+    """
+    models = _models_cache.get('models')
+    if models is not None and models.fingerprint == fingerprint:
+        return models
+
+    models = None
+    if path is not None and os.path.exists(path):
+        try:
+            models = SeasonalModels.load(path)
+        except (OSError, ValueError, KeyError):
+            models = None
+        if models is not None and models.fingerprint != fingerprint:
+            models = None
+    if models is None:
+        models = SeasonalModels.fit(data, fingerprint)
+        if path is not None:
+            try:
+                models.save(path)
+            except OSError:
+                # каталог хранилища удален (см. columnar.prune_upload_stores) - модели остаются в памяти
+                pass
+
+    _models_cache['models'] = models
+    return models
@@ -0,0 +1,231 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+SEASONS = ['winter', 'spring', 'summer', 'autumn']
+MONTH_TO_SEASON = {12: 'winter', 1: 'winter', 2: 'winter',
+                   3: 'spring', 4: 'spring', 5: 'spring',
+                   6: 'summer', 7: 'summer', 8: 'summer',
+                   9: 'autumn', 10: 'autumn', 11: 'autumn'}
+
+STAT_COLUMNS = ['count', 'min', 'max', 'mean', 'std']
+
+# четыре сезона плюс блок для строк без распознанного сезона
+_SLOTS = len(SEASONS) + 1
+
+NS_PER_DAY = 86_400 * 10**9
+
+
+def season_of(timestamps):
+    """
+    Сезон ('winter', 'spring', ...) по месяцу для серии дат
+    """
+    return timestamps.dt.month.map(MONTH_TO_SEASON)
+
+
+def season_codes(data):
+    """
+    Коды сезонов строк: индекс в SEASONS, -1 - сезон не распознан.
+    Для категориальной колонки season (см. columnar.load_data) это ее коды, без сравнения строк;
+    без колонки season сезон определяется по месяцу
+    """
+    if 'season' not in data.columns:
+        return month_season_codes(data)
+    seasons = data['season']
+    if isinstance(seasons.dtype, pd.CategoricalDtype) and list(seasons.cat.categories) == SEASONS:
+        return seasons.cat.codes.to_numpy()
+    return pd.Categorical(seasons.str.lower(), categories=SEASONS).codes
+
+
+def month_season_codes(data):
+    """
+    Коды сезонов по месяцу даты (как на страницах дашборда): из готовой колонки
+    season_number, если она есть, иначе по timestamp
+    """
+    if 'season_number' in data.columns:
+        return data['season_number'].to_numpy().astype(np.int8) - 1
+    return pd.Categorical(season_of(data['timestamp']), categories=SEASONS).codes
+
+
+def trend_slope(timestamps, temperature):
+    """
+    Наклон МНК-тренда температуры, градусов в день (ось x - целые дни от первой даты).
+    В регрессию входят только строки, где есть и дата, и температура;
+    если таких строк меньше двух или все в один день - NaN
+    """
+    ns = np.asarray(timestamps)
+    ns = ns.astype('datetime64[ns]').view(np.int64) if ns.dtype.kind == 'M' else ns.astype(np.int64)
+    y = np.asarray(temperature, dtype=np.float64)
+    valid = (ns != np.iinfo(np.int64).min) & ~np.isnan(y)
+    if np.count_nonzero(valid) < 2:
+        return np.nan
+    ns, y = ns[valid], y[valid]
+    x = ((ns - ns.min()) // NS_PER_DAY).astype(np.float64)
+    dx = x - x.mean()
+    sxx = (dx * dx).sum()
+    if sxx == 0:
+        return np.nan
+    return (dx * (y - y.mean())).sum() / sxx
+
+
+def trend_label(slope):
+    """
+    Текстовое описание тренда по наклону (NaN - 'Нет явного тренда')
+    """
+    if slope > 0:
+        return 'Положительный тренд'
+    if slope < 0:
+        return 'Отрицательный тренд'
+    return 'Нет явного тренда'
+
+
+def file_fingerprint(path):
+    """
+    Отпечаток CSV-файла на диске: путь, размер и время изменения.
+    Дешевый способ понять, что исходные данные поменялись
+    """
+    st = os.stat(path)
+    return f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def bytes_fingerprint(raw):
+    """
+    Отпечаток загруженного файла (например, из st.file_uploader) по его содержимому
+    """
+    return hashlib.md5(raw).hexdigest()
+
+
+def group_stats(values, codes, n_groups):
+    """
+    count, min, max, mean, std (ddof=1) по группам для значений, отсортированных
+    по коду группы (каждая группа - непрерывный участок). Пропуски не учитываются.
+    Возвращает массив [группа, STAT_COLUMNS]
+    """
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    values, codes = values[known], codes[known]
+
+    count = np.bincount(codes, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, values, minlength=n_groups) / count
+        m2 = np.bincount(codes, (values - mean[codes]) ** 2, minlength=n_groups)
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+
+    # группы идут подряд, поэтому min/max - reduceat по началам непустых групп
+    starts = np.concatenate([[0], np.cumsum(count)[:-1]])[count > 0]
+    low = np.full(n_groups, np.nan)
+    high = np.full(n_groups, np.nan)
+    if len(values):
+        low[count > 0] = np.minimum.reduceat(values, starts)
+        high[count > 0] = np.maximum.reduceat(values, starts)
+    return np.column_stack([count, low, high, mean, std])
+
+
+def index_layout(city_codes, season_codes, temperature, n_cities):
+    """
+    Раскладка индекса по кодам городов и сезонов строк:
+      order - номера строк, упорядоченные по (город, сезон) с исходным порядком внутри блока
+      offsets - order[offsets[i * 5 + s]:offsets[i * 5 + s + 1]] - строки города i в сезоне s
+      season_stats, city_stats - STAT_COLUMNS по блокам и по городам
+    Строки без города в индекс не входят
+    """
+    city_codes = np.asarray(city_codes, dtype=np.int64)
+    season_codes = np.asarray(season_codes, dtype=np.int64)
+    # строки с нераспознанным сезоном уходят в отдельный, последний блок города
+    blocks = city_codes * _SLOTS + np.where(season_codes < 0, len(SEASONS), season_codes)
+
+    rows = np.flatnonzero(city_codes >= 0)
+    order = rows[np.argsort(blocks[rows], kind='stable')]
+    blocks = blocks[order]
+    counts = np.bincount(blocks, minlength=n_cities * _SLOTS)
+
+    values = np.asarray(temperature)[order]
+    return {
+        'order': order,
+        'offsets': np.concatenate([[0], np.cumsum(counts)]),
+        'season_stats': group_stats(values, blocks, n_cities * _SLOTS),
+        # в порядке order строки города тоже идут подряд
+        'city_stats': group_stats(values, blocks // _SLOTS, n_cities),
+    }
+
+
+class CityIndex:
+    """
+    Индекс по датафрейму с температурами, строится один раз при загрузке данных.
+
+    Датафрейм не копируется и не переупорядочивается: индекс хранит перестановку
+    строк order, в которой каждый город, а внутри него каждый сезон, лежат
+    непрерывным блоком (исходный порядок строк внутри блока сохраняется), смещения
+    блоков и заранее посчитанные count, min, max, mean, std для пар (город, сезон)
+    и для городов целиком (см. index_layout).
+
+    Для данных из колоночного хранилища раскладка уже посчитана при его сборке
+    (columnar.read_layout) - тогда индекс ничего не пересчитывает.
+    Благодаря этому analysis() и вкладка "Обзор" дашборда получают строки города
+    за O(строк города), а статистики - за O(1).
+    """
+
+    def __init__(self, data, fingerprint=None, layout=None):
+        self.data = data
+        self.fingerprint = fingerprint
+
+        if layout is None:
+            city_codes, cities = pd.factorize(data['city'])
+            layout = index_layout(city_codes, season_codes(data), data['temperature'].to_numpy(), len(cities))
+            layout['cities'] = list(cities)
+
+        self.cities = list(layout['cities'])
+        self.city_pos = {city: i for i, city in enumerate(self.cities)}
+        self.order = layout['order']
+        self.offsets = np.asarray(layout['offsets'])
+        self.season_stats = np.asarray(layout['season_stats'], dtype=np.float64)
+        self.city_stats = np.asarray(layout['city_stats'], dtype=np.float64)
+        # каталог колоночного хранилища, из которого загружены данные (для моделей рядом с ним)
+        self.store_dir = layout.get('store_dir')
+
+    def __contains__(self, city_name):
+        return city_name in self.city_pos
+
+    def _bounds(self, city_name, season=None):
+        i = self.city_pos[city_name] * _SLOTS
+        if season is None:
+            return self.offsets[i], self.offsets[i + _SLOTS]
+        s = SEASONS.index(season)
+        return self.offsets[i + s], self.offsets[i + s + 1]
+
+    def rows(self, city_name, season=None):
+        """
+        Строки города (и, если указан, сезона) - выборка по перестановке order
+        без сканирования всего датафрейма
+        """
+        start, stop = self._bounds(city_name, season)
+        return self.data.iloc[self.order[start:stop]]
+
+    def stats(self, city_name, season=None):
+        """
+        Заранее посчитанные count, min, max, mean, std для города или пары (город, сезон)
+        """
+        i = self.city_pos[city_name]
+        if season is None:
+            row = self.city_stats[i]
+        else:
+            row = self.season_stats[i * _SLOTS + SEASONS.index(season)]
+        return pd.Series(row, index=STAT_COLUMNS, name=city_name)
+
+
+_index_cache = {}
+
+
+def get_index(data, fingerprint, layout=None):
+    """
+    Возвращает индекс для данных с заданным отпечатком.
+    Индекс пересобирается только когда отпечаток исходных данных меняется;
+    layout - готовая раскладка из колоночного хранилища (columnar.read_layout)
+    """
+    index = _index_cache.get('index')
+    if index is None or index.fingerprint != fingerprint:
+        index = CityIndex(data, fingerprint, layout)
+        _index_cache['index'] = index
+    return index
@@ -0,0 +1,290 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from stats_index import season_of
+from anomalies import MEAN_WINDOW, STD_WINDOW, rolling_mean_std, flag_anomalies
+
+KEYS = ['city', 'season']
+
+NS_PER_DAY = 86_400 * 10**9
+
+# аккумуляторы по паре (город, сезон): n, mean, m2, min, max - по температуре,
+# nt, x_mean, ty_mean, mxx, cxy - тренд по строкам, где есть и дата, и температура
+ACCUMULATORS = ['n', 'mean', 'm2', 'min', 'max', 'nt', 'x_mean', 'ty_mean', 'mxx', 'cxy', 'anomalies', 'origin']
+
+
+def prepare_rows(rows):
+    """
+    Приводит строки к виду, который ждет StreamingAnalysis:
+    разобранные даты, сезон в нижнем регистре, температура float32
+    """
+    rows = rows.copy()
+    rows['timestamp'] = pd.to_datetime(rows['timestamp'], errors='coerce')
+    if 'season' in rows.columns:
+        rows['season'] = rows['season'].astype(str).str.lower()
+    else:
+        rows['season'] = season_of(rows['timestamp'])
+    rows['city'] = rows['city'].astype(str)
+    rows['temperature'] = rows['temperature'].astype(np.float32)
+    return rows[['city', 'timestamp', 'temperature', 'season']]
+
+
+def read_chunks(csv_path, chunksize=1_000_000):
+    """
+    Генератор чанков CSV с разобранными датами и сезоном в нижнем регистре.
+    Температура читается как float32 - так же, как в columnar.load_data
+    """
+    reader = pd.read_csv(csv_path, chunksize=chunksize, dtype={'temperature': np.float32})
+    for chunk in reader:
+        yield prepare_rows(chunk)
+
+
+def _merge(a, b):
+    """
+    Объединение аккумуляторов двух частей данных (формулы Чана для mean/M2
+    и для совместного момента x-y), векторно по всем парам (город, сезон)
+    """
+    a = a.reindex(a.index.union(b.index))
+    b = b.reindex(a.index)
+
+    def weights(count):
+        # доля второй части и вес поправки n_a * n_b / n; у пустых пар - нули
+        ca = a[count].fillna(0)
+        cb = b[count].fillna(0)
+        total = ca + cb
+        return total, (cb / total).fillna(0), (ca * cb / total).fillna(0)
+
+    n, share, w = weights('n')
+    nt, share_t, w_t = weights('nt')
+
+    dy = b['mean'].fillna(0) - a['mean'].fillna(0)
+    dx = b['x_mean'].fillna(0) - a['x_mean'].fillna(0)
+    dty = b['ty_mean'].fillna(0) - a['ty_mean'].fillna(0)
+
+    merged = pd.DataFrame(index=a.index)
+    merged['n'] = n
+    merged['mean'] = a['mean'].fillna(0) + dy * share
+    merged['m2'] = a['m2'].fillna(0) + b['m2'].fillna(0) + dy * dy * w
+    merged['min'] = np.fmin(a['min'], b['min'])
+    merged['max'] = np.fmax(a['max'], b['max'])
+    merged['nt'] = nt
+    merged['x_mean'] = a['x_mean'].fillna(0) + dx * share_t
+    merged['ty_mean'] = a['ty_mean'].fillna(0) + dty * share_t
+    merged['mxx'] = a['mxx'].fillna(0) + b['mxx'].fillna(0) + dx * dx * w_t
+    merged['cxy'] = a['cxy'].fillna(0) + b['cxy'].fillna(0) + dx * dty * w_t
+    merged['anomalies'] = a['anomalies'].fillna(0) + b['anomalies'].fillna(0)
+    merged['origin'] = a['origin'].fillna(b['origin'])
+    return merged
+
+
+class StreamingAnalysis:
+    """
+    Потоковый анализ, когда история не помещается в память целиком.
+
+    По каждой паре (город, сезон) хранит только аккумуляторы: count, min, max,
+    mean и M2 (дисперсия по Уэлфорду), суммы для МНК-тренда и последние
+    MEAN_WINDOW - 1 значений (tail: пара -> массив), чтобы скользящие окна продолжались
+    через границы чанков. Память - O(размер чанка + число городов), результат совпадает с analyze_all()
+
+    Состояние можно сохранить (save/load) и дальше дописывать новые показания
+    через append - за O(новых строк): обновляются только строки stats и хвосты
+    пар, которые есть в новых данных, без пересчета всей истории
+    """
+
+    def __init__(self):
+        self.stats = pd.DataFrame(
+            columns=ACCUMULATORS,
+            index=pd.MultiIndex.from_arrays([[], []], names=KEYS),
+            dtype=np.float64,
+        )
+        self.tail = {}
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Состояние по датафрейму, который уже загружен в память
+        """
+        state = cls()
+        state.update(prepare_rows(data))
+        return state
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if 'nt' not in state.stats.columns:
+            # состояние из версии без отдельного счетчика тренда: тренд шел по всем строкам
+            state.stats['nt'] = state.stats['n']
+            state.stats['ty_mean'] = state.stats['mean']
+            state.stats = state.stats[ACCUMULATORS]
+        if isinstance(state.tail, pd.DataFrame):
+            # хвосты одной таблицей (прежний формат) -> словарь по парам
+            state.tail = {
+                key: group['temperature'].to_numpy(np.float64)
+                for key, group in state.tail.groupby(KEYS, sort=False)
+            }
+        return state
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    def append(self, new_rows):
+        """
+        Дописывает новые показания (city, timestamp, temperature[, season]):
+        обновляет аккумуляторы, суммы тренда и буферы окон только по новым строкам.
+
+        Возвращает новые строки с колонками rolling_mean, rolling_std и is_anomaly
+        """
+        rows = prepare_rows(new_rows).reset_index(drop=True)
+        flags = self.update(rows)
+        return rows.join(flags)
+
+    def update(self, chunk):
+        """
+        Учитывает очередной чанк. Внутри пары (город, сезон) строки должны идти
+        в хронологическом порядке - как в исходном CSV.
+        Возвращает rolling_mean, rolling_std и is_anomaly для строк чанка
+        """
+        chunk = chunk.dropna(subset=['city', 'season'])
+        keys = pd.MultiIndex.from_arrays([chunk['city'], chunk['season']], names=KEYS)
+        y = chunk['temperature'].astype(np.float64).to_numpy()
+
+        # ось x тренда - дни от первой увиденной даты пары, на наклон сдвиг не влияет.
+        # Строки без даты (NaT) или без температуры в тренд не входят, как в analyze_all
+        chunk_origin = chunk.groupby(KEYS, sort=False, observed=True)['timestamp'].min()
+        # из накопленного состояния берутся только пары чанка
+        current = self.stats.reindex(chunk_origin.index)
+        origin = current['origin'].fillna(chunk_origin.astype(np.int64).astype(np.float64).where(chunk_origin.notna()))
+        row_origin = origin.reindex(keys).to_numpy()
+        timestamps = chunk['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        paired = chunk['timestamp'].notna().to_numpy() & ~np.isnan(y) & ~np.isnan(row_origin)
+        x = np.full(len(y), np.nan)
+        x[paired] = (timestamps[paired] - row_origin[paired].astype(np.int64)) // NS_PER_DAY
+        flags = self._rolling_anomalies(chunk)
+
+        part = pd.DataFrame({'x': x, 'y': y, 'ty': np.where(paired, y, np.nan)}, index=keys)
+        by_key = part.groupby(level=KEYS, sort=False)
+        dx = part['x'] - by_key['x'].transform('mean')
+        dy = part['y'] - by_key['y'].transform('mean')
+        dty = part['ty'] - by_key['ty'].transform('mean')
+        part = part.assign(dxx=dx * dx, dxy=dx * dty, dyy=dy * dy)
+        by_key = part.groupby(level=KEYS, sort=False)
+
+        chunk_stats = pd.DataFrame({
+            'n': by_key['y'].count(),
+            'mean': by_key['y'].mean(),
+            'm2': by_key['dyy'].sum(),
+            'min': by_key['y'].min(),
+            'max': by_key['y'].max(),
+            'nt': by_key['x'].count(),
+            'x_mean': by_key['x'].mean(),
+            'ty_mean': by_key['ty'].mean(),
+            'mxx': by_key['dxx'].sum(),
+            'cxy': by_key['dxy'].sum(),
+            'anomalies': flags['is_anomaly'].groupby(keys, sort=False).sum().reindex(origin.index),
+            'origin': origin,
+        })
+        merged = _merge(current, chunk_stats)[ACCUMULATORS]
+
+        # известные пары обновляются на месте, новые дописываются в конец
+        positions = self.stats.index.get_indexer(merged.index)
+        known = positions >= 0
+        self.stats.iloc[positions[known]] = merged.to_numpy()[known]
+        if not known.all():
+            added = merged[~known]
+            self.stats = pd.concat([self.stats, added]) if len(self.stats) else added
+        return flags
+
+    def _rolling_anomalies(self, chunk):
+        """
+        Скользящие mean/std по чанку с хвостом предыдущих значений каждой пары:
+        окна считаются так, как если бы вся история была в памяти.
+        Берутся и обновляются только хвосты пар, которые есть в чанке.
+        Строки без даты в окна не входят (как в analyze_all): у них NaN и не аномалия
+        """
+        flags = pd.DataFrame({'rolling_mean': np.nan, 'rolling_std': np.nan, 'is_anomaly': False},
+                             index=chunk.index)
+        chunk = chunk[chunk['timestamp'].notna()]
+        codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([chunk['city'], chunk['season']]))
+        order = np.argsort(codes, kind='stable')
+        new_counts = np.bincount(codes, minlength=len(pairs))
+        new_values = np.split(chunk['temperature'].to_numpy(np.float64)[order], np.cumsum(new_counts)[:-1])
+
+        # по каждой паре подряд: хвост прошлых значений, затем новые строки
+        tails = [self.tail.get(key, np.empty(0)) for key in pairs]
+        tail_counts = np.array([len(tail) for tail in tails], dtype=np.int64)
+        values = np.concatenate([part for tail, new in zip(tails, new_values) for part in (tail, new)] or [np.empty(0)])
+        offsets = np.concatenate([[0], np.cumsum(tail_counts + new_counts)])
+        is_new = np.ones(len(values), dtype=bool)
+        for start, count in zip(offsets[:-1], tail_counts):
+            is_new[start:start + count] = False
+
+        rolling_mean, rolling_std = rolling_mean_std(values, offsets, MEAN_WINDOW, STD_WINDOW)
+        is_anomaly = flag_anomalies(values, rolling_mean, rolling_std)
+
+        for key, start, stop in zip(pairs, offsets[:-1], offsets[1:]):
+            self.tail[key] = values[max(stop - (MEAN_WINDOW - 1), start):stop].copy()
+
+        rolled = np.empty(len(order), dtype=np.int64)
+        rolled[order] = np.flatnonzero(is_new)
+        flags.loc[chunk.index, 'rolling_mean'] = rolling_mean[rolled]
+        flags.loc[chunk.index, 'rolling_std'] = rolling_std[rolled]
+        flags.loc[chunk.index, 'is_anomaly'] = is_anomaly[rolled]
+        return flags
+
+    def result(self, season=None):
+        """
+        Итог в виде analyze_all: строка на пару (город, сезон), по умолчанию все сезоны
+        """
+        stats = self.stats
+        if season is not None:
+            stats = stats.xs(season, level='season', drop_level=False)
+
+        result = pd.DataFrame({
+            'count': stats['n'].astype(np.int64),
+            'mean': stats['mean'].where(stats['n'] > 0),
+            'min': stats['min'],
+            'max': stats['max'],
+            'std': np.sqrt(stats['m2'] / (stats['n'] - 1)),
+            'anomalies': stats['anomalies'].astype(np.int64),
+            'slope': stats['cxy'] / stats['mxx'],
+        })
+        result['trend'] = np.select(
+            [result['slope'] > 0, result['slope'] < 0],
+            ['Положительный тренд', 'Отрицательный тренд'],
+            'Нет явного тренда'
+        )
+        return result.reset_index()
+
+    def city_stats(self):
+        """
+        Профиль города целиком (все сезоны): count, mean, min, max, std
+        """
+        stats = self.stats
+        by_city = stats.groupby(level='city', sort=False)
+        n = by_city['n'].sum()
+        mean = (stats['n'] * stats['mean']).groupby(level='city', sort=False).sum() / n
+        # M2 города = сумма M2 сезонов + разброс средних сезонов вокруг общего среднего
+        between = stats['n'] * (stats['mean'] - mean.reindex(stats.index.get_level_values('city')).to_numpy()) ** 2
+        m2 = by_city['m2'].sum() + between.groupby(level='city', sort=False).sum()
+        return pd.DataFrame({
+            'count': n.astype(np.int64),
+            'mean': mean,
+            'min': by_city['min'].min(),
+            'max': by_city['max'].max(),
+            'std': np.sqrt(m2 / (n - 1)),
+        })
+
+
+def stream_analysis(csv_path, season=None, chunksize=1_000_000):
+    """
+    Анализ CSV по чанкам без загрузки в память целиком.
+    Возвращает итог StreamingAnalysis.result и само состояние анализа
+    """
+    state = StreamingAnalysis()
+    for chunk in read_chunks(csv_path, chunksize):
+        state.update(chunk)
+    return state.result(season), state
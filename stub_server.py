@@ -0,0 +1,154 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+from aiohttp import web
+
+from weather_client import GROUP_SIZE, WeatherClient
+
+
+def city_id(city):
+    """
+    Стабильный числовой id города для заглушки
+    """
+    return zlib.crc32(city.encode('utf-8')) % 10_000_000
+
+
+def fake_weather(city):
+    """
+    Ответ в формате OpenWeatherMap /weather с правдоподобной температурой
+    """
+    return {
+        'id': city_id(city),
+        'name': city,
+        'dt': int(time.time()),
+        'main': {'temp': 273.15 + random.uniform(-20, 35)},
+    }
+
+
+def make_app(latency=0.05, jitter=0.05, error_rate=0.0):
+    """
+    Локальная заглушка OpenWeatherMap для офлайн-замеров.
+
+    latency и jitter задают задержку ответа в секундах, error_rate - долю
+    ответов 429/503 (проверка повторов клиента)
+    """
+
+    # id -> название для /group: заглушка знает города, которые уже запрашивались через /weather
+    names = {}
+
+    def stub_error():
+        if random.random() < error_rate:
+            status = random.choice([429, 503])
+            return web.json_response({'cod': status, 'message': 'stub error'}, status=status,
+                                     headers={'Retry-After': '0'})
+        return None
+
+    async def weather(request):
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+        error = stub_error()
+        if error is not None:
+            return error
+        city = request.query.get('q')
+        if not city:
+            return web.json_response({'cod': '400', 'message': 'Nothing to geocode'}, status=400)
+        names[city_id(city)] = city
+        return web.json_response(fake_weather(city))
+
+    async def group(request):
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+        error = stub_error()
+        if error is not None:
+            return error
+        ids = [int(i) for i in request.query.get('id', '').split(',') if i]
+        if not ids or len(ids) > GROUP_SIZE:
+            return web.json_response({'cod': '400', 'message': 'Invalid id count'}, status=400)
+        cities = [names[i] for i in ids if i in names]
+        return web.json_response({'cnt': len(cities), 'list': [fake_weather(city) for city in cities]})
+
+    app = web.Application()
+    app.router.add_get('/data/2.5/weather', weather)
+    app.router.add_get('/data/2.5/group', group)
+    return app
+
+
+async def start_stub_server(host='127.0.0.1', port=0, **kwargs):
+    """
+    Запускает заглушку в текущем event loop.
+    Возвращает runner (для runner.cleanup()) и base_url для WeatherClient
+    """
+    runner = web.AppRunner(make_app(**kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}/data/2.5'
+
+
+def start_stub_thread(**kwargs):
+    """
+    Запускает заглушку в фоновом потоке со своим event loop - для синхронного кода.
+    Возвращает base_url и функцию остановки
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    runner, base_url = asyncio.run_coroutine_threadsafe(start_stub_server(**kwargs), loop).result()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return base_url, stop
+
+
+async def benchmark_client(n_cities=1000, concurrency=50, rate=0, **server_kwargs):
+    """
+    Замер пропускной способности и хвостовых задержек WeatherClient на заглушке
+    (по умолчанию без лимита частоты: у заглушки нет тарифного плана)
+    """
+    runner, base_url = await start_stub_server(**server_kwargs)
+    cities = [f'city-{i}' for i in range(n_cities)]
+    latencies = []
+    errors = 0
+
+    async def timed_fetch(client, city):
+        # задержка одного запроса, включая ожидание семафора и лимита частоты
+        start = time.perf_counter()
+        try:
+            await client.fetch(city)
+            return False
+        except Exception:
+            return True
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        async with WeatherClient('stub', base_url, concurrency=concurrency, rate=rate,
+                                 backoff=0.01) as client:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(timed_fetch(client, city) for city in cities))
+            total = time.perf_counter() - start
+            errors = sum(results)
+    finally:
+        await runner.cleanup()
+
+    return {
+        'cities': n_cities,
+        'errors': errors,
+        'seconds': total,
+        'cities_per_second': n_cities / total,
+        'p50': float(np.percentile(latencies, 50)),
+        'p95': float(np.percentile(latencies, 95)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(asyncio.run(benchmark_client(n, error_rate=0.05)))
@@ -1,59 +1,59 @@
 import time
 import asyncio
-import aiohttp
-import pandas as pd
 
-from scripts import current_temp, async_current_temp, analysis
-from multiprocessing import Pool
+from scripts import (current_temp, async_current_temp, analysis, analyze_all, parallel_analysis,
+                     screen_all_current, data, require_api_key, base_url)
+from weather_client import WeatherClient
+from benchmarks import measure, summarize
 
-data = pd.read_csv('temperature_data.csv')
 cities = data['city'].unique()
 
-def test_sync_analysis():
+
+def report(title, times):
+    """
+    Печатает сводку замеров (см. benchmarks.summarize) и возвращает ее.
+    Для полного набора сценариев на синтетических данных есть benchmarks.py
+    """
+    summary = summarize(times, rows=len(data), cities=len(cities))
+    print(
+        f"{title}: {summary['mean']:.4f} секунд "
+        f"(p50 {summary['p50']:.4f}, p95 {summary['p95']:.4f}, повторов: {summary['repeats']}), "
+        f"{summary['mean'] / len(cities):.4f} секунд на город, "
+        f"{summary['cities_per_second']:.1f} городов/с"
+    )
+    return summary
+
+def test_sync_analysis(repeats=1):
     """Тест синхронного анализа"""
-    start_time = time.time()
-    for city in cities:
-        analysis(city)
-    end_time = time.time()
-    avg_time = (end_time - start_time) / len(cities)
-    print(f"Среднее время выполнения синхронного анализа на один город: {avg_time:.2f} секунд")
-    print(f"Общее время выполнения синхронного анализа: {end_time - start_time:.2f} секунд")
-
-def test_parallel_analysis():
+    times = measure(lambda: [analysis(city) for city in cities], repeats, warmup=0)
+    return report("Синхронный анализ", times)
+
+def test_parallel_analysis(repeats=1):
     """Тест параллельного анализа"""
-    start_time = time.time()
-    with Pool() as pool:
-        pool.map(analysis, cities)
-    end_time = time.time()
-    avg_time = (end_time - start_time) / len(cities)
-    print(f"Среднее время выполнения параллельного анализа на один город: {avg_time:.2f} секунд")
-    print(f"Общее время выполнения параллельного анализа: {end_time - start_time:.2f} секунд")
-
-def test_sync_temp():
-    """Тест синхронной функции"""
-    start_time = time.time()
-    total_time = 0
-    for city in cities:
-        city_start = time.time()
-        current_temp(city)
-        city_end = time.time()
-        total_time += (city_end - city_start)
-    end_time = time.time()
-    avg_time = total_time / len(cities)
-    print(f"Среднее время выполнения синхронно на один город: {avg_time:.2f} секунд")
-    print(f"Общее время выполнения синхронно: {end_time - start_time:.2f} секунд")
-
-async def test_async_temp():
-    """Тест асинхронной функции"""
-    start_time = time.time()
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for city in cities:
-            city_start = time.time()
-            tasks.append(async_current_temp(city))
-            city_end = time.time()
-        await asyncio.gather(*tasks)
-    end_time = time.time()
-    avg_time = (end_time - start_time) / len(cities)
-    print(f"Среднее время выполнения асинхронно на один город: {avg_time:.2f} секунд")
-    print(f"Общее время выполнения асинхронно: {end_time - start_time:.2f} секунд")
+    times = measure(lambda: parallel_analysis(cities), repeats, warmup=0)
+    return report("Параллельный анализ", times)
+
+def test_batch_analysis(repeats=1):
+    """Тест векторизованного анализа всех городов за один проход"""
+    times = measure(lambda: analyze_all(data), repeats, warmup=0)
+    return report("Векторизованный анализ", times)
+
+def test_sync_temp(repeats=1):
+    """Тест синхронной функции: каждый повтор - запросы к API, без кэша погоды"""
+    times = measure(lambda: [current_temp(city, cached=False) for city in cities], repeats, warmup=0)
+    return report("Синхронные запросы погоды", times)
+
+async def test_async_temp(repeats=1):
+    """Тест асинхронной функции: время до завершения всех запросов к API (без кэша погоды)"""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        async with WeatherClient(require_api_key(), base_url, cache=None) as client:
+            await asyncio.gather(*(async_current_temp(city, client) for city in cities))
+        times.append(time.perf_counter() - start_time)
+    return report("Асинхронные запросы погоды", times)
+
+def test_screen_all(repeats=1):
+    """Тест проверки всех городов пачками через /group (погода без кэша, id городов - из кэша)"""
+    times = measure(lambda: screen_all_current(cities, cached=False), repeats, warmup=0)
+    return report("Пакетная проверка погоды", times)
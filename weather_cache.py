@@ -0,0 +1,333 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# OpenWeatherMap обновляет данные примерно раз в 10 минут
+DEFAULT_TTL = 600
+DEFAULT_MAXSIZE = 4096
+
+
+class MemoryBackend:
+    """
+    Хранилище в памяти процесса: LRU на OrderedDict с временем истечения записей
+    """
+
+    blocking = False
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, items, ttl):
+        with self._lock:
+            expires = time.time() + ttl
+            for key, value in items.items():
+                self._items[key] = (value, expires)
+                self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteBackend:
+    """
+    Хранилище в SQLite-файле: общее для нескольких процессов (воркеры Streamlit,
+    скрипты с current_temp/async_current_temp). Размер ограничивается по LRU.
+
+    Вытеснение идет пачками: когда записей становится больше maxsize, самые давно
+    прочитанные удаляются до maxsize - maxsize // 10 по индексу на accessed,
+    поэтому запись не сортирует всю таблицу. Вызовы блокирующие - асинхронный
+    код выполняет их в потоке (см. WeatherCache)
+    """
+
+    blocking = True
+
+    def __init__(self, path, maxsize=DEFAULT_MAXSIZE, table='weather_cache'):
+        self.path = path
+        self.maxsize = maxsize
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)'
+        )
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+        # оценка сверху числа записей: точный COUNT(*) - только когда она больше maxsize
+        self._size = len(self)
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys, batch=500):
+        now = time.time()
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), batch):
+                chunk = keys[i:i + batch]
+                rows = self._conn.execute(
+                    f'SELECT key, value, expires FROM {self.table} '
+                    f'WHERE key IN ({", ".join("?" * len(chunk))})', chunk
+                ).fetchall()
+                expired = [(key,) for key, _, expires in rows if expires < now]
+                fresh = [(key, value) for key, value, expires in rows if expires >= now]
+                if expired or fresh:
+                    with self._transaction():
+                        self._conn.executemany(f'DELETE FROM {self.table} WHERE key = ?', expired)
+                        self._conn.executemany(
+                            f'UPDATE {self.table} SET accessed = ? WHERE key = ?',
+                            [(now, key) for key, _ in fresh]
+                        )
+                found.update((key, json.loads(value)) for key, value in fresh)
+        return found
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # одна транзакция на пачку вместо автокоммита каждой строки
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items, ttl):
+        now = time.time()
+        rows = [(key, json.dumps(value), now + ttl, now) for key, value in items.items()]
+        with self._lock, self._transaction():
+            self._conn.executemany(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)', rows)
+            self._size += len(rows)
+            if self._size > self.maxsize:
+                self._evict()
+
+    def _evict(self):
+        size = self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        if size > self.maxsize:
+            target = self.maxsize - self.maxsize // 10
+            self._conn.execute(
+                f'DELETE FROM {self.table} WHERE key IN ('
+                f'SELECT key FROM {self.table} ORDER BY accessed LIMIT ?)',
+                (size - target,)
+            )
+            size = target
+        self._size = size
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+
+class WeatherCache:
+    """
+    Кэш ответов о текущей погоде по ключу (городу) с TTL.
+
+    Одновременные промахи по одному ключу объединяются (single-flight): запрос
+    к API делает только первый вызов, остальные ждут его результат.
+    Счетчики hits/misses/coalesced (ожидания чужого запроса) доступны через stats()
+    """
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._async_inflight = {}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self._count('misses' if value is None else 'hits')
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def get_many(self, keys):
+        """
+        Свежие значения для нескольких ключей одним обращением к хранилищу: dict ключ -> значение
+        """
+        keys = list(keys)
+        found = self.backend.get_many(keys)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        self.backend.set_many(items, self.ttl)
+
+    async def _call(self, func, *args):
+        """
+        Вызов хранилища из асинхронного кода: блокирующее (SQLite) выполняется
+        в потоке, чтобы не останавливать цикл событий
+        """
+        if getattr(self.backend, 'blocking', False):
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def get_many_async(self, keys):
+        return await self._call(self.get_many, keys)
+
+    async def set_many_async(self, items):
+        if items:
+            await self._call(self.set_many, items)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Значение из кэша или результат fetch() (для синхронного кода)
+        """
+        value = self.backend.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = fetch()
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def get_or_fetch_async(self, key, fetch):
+        """
+        Значение из кэша или результат await fetch() (для асинхронного кода)
+        """
+        value = await self._call(self.backend.get, key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        future = self._async_inflight.get(key)
+        if future is not None:
+            self._count('coalesced')
+            return await asyncio.shield(future)
+
+        self._count('misses')
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch()
+            await self._call(self.set, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # чтобы не было предупреждения о необработанном исключении без ожидающих
+            future.exception()
+            raise
+        finally:
+            del self._async_inflight[key]
+
+    def stats(self):
+        total = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (self.hits + self.coalesced) / total if total else 0.0,
+            'size': len(self.backend),
+        }
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Общий кэш процесса. Если задана переменная WEATHER_CACHE_PATH - кэш в SQLite
+    по этому пути (общий для процессов), иначе в памяти.
+    TTL задается переменной WEATHER_CACHE_TTL (секунды)
+    """
+    global _default_cache
+    if _default_cache is None:
+        path = os.environ.get('WEATHER_CACHE_PATH')
+        backend = SQLiteBackend(path) if path else MemoryBackend()
+        ttl = float(os.environ.get('WEATHER_CACHE_TTL', DEFAULT_TTL))
+        _default_cache = WeatherCache(backend, ttl)
+    return _default_cache
+
+
+# id города в OpenWeatherMap не меняется, поэтому кэш id живет долго
+CITY_ID_TTL = 30 * 24 * 3600
+CITY_ID_MAXSIZE = 100_000
+
+_city_id_cache = None
+
+
+def city_id_cache():
+    """
+    Общий кэш id городов (название -> id OpenWeatherMap) для запросов /group.
+    Если задан WEATHER_CACHE_PATH - в отдельной таблице того же SQLite-файла, иначе в памяти
+    """
+    global _city_id_cache
+    if _city_id_cache is None:
+        path = os.environ.get('WEATHER_CACHE_PATH')
+        if path:
+            backend = SQLiteBackend(path, CITY_ID_MAXSIZE, table='city_ids')
+        else:
+            backend = MemoryBackend(CITY_ID_MAXSIZE)
+        _city_id_cache = WeatherCache(backend, CITY_ID_TTL)
+    return _city_id_cache
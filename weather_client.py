@@ -0,0 +1,279 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+BASE_URL = "http://api.openweathermap.org/data/2.5"
+
+# коды, на которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# сколько id городов API принимает в одном запросе /group
+GROUP_SIZE = 20
+
+# лимит запросов в минуту по умолчанию - бесплатный план OpenWeatherMap
+DEFAULT_RATE_PER_MINUTE = 60
+
+
+class WeatherAPIError(Exception):
+    """
+    Ошибка ответа OpenWeatherMap (неверный ключ, неизвестный город, исчерпанные повторы)
+    """
+
+    def __init__(self, status, city, message=''):
+        super().__init__(f'{city}: HTTP {status} {message}'.strip())
+        self.status = status
+        self.city = city
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: rate токенов в секунду, запас до capacity.
+    Настраивается под тарифный план API (см. default_rate).
+    Один и тот же ограничитель можно использовать и из асинхронного кода (acquire),
+    и из синхронного (acquire_sync), в том числе из разных циклов событий и потоков
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """
+        Забирает токен, если он есть, и возвращает 0; иначе - сколько секунд подождать
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+def default_rate():
+    """
+    Лимит запросов в секунду: OPENWEATHER_RATE из окружения (запросов в минуту,
+    как в тарифных планах API; 0 - без ограничения) или DEFAULT_RATE_PER_MINUTE
+    """
+    return float(os.environ.get('OPENWEATHER_RATE', DEFAULT_RATE_PER_MINUTE)) / 60
+
+
+_buckets = {}
+
+
+def shared_bucket(rate):
+    """
+    Общий на процесс TokenBucket для лимита rate (запросов в секунду): все клиенты
+    и синхронная сессия с одним лимитом делят его, None - без ограничения
+    """
+    if not rate:
+        return None
+    bucket = _buckets.get(rate)
+    if bucket is None:
+        bucket = _buckets.setdefault(rate, TokenBucket(rate))
+    return bucket
+
+
+class WeatherClient:
+    """
+    Асинхронный клиент OpenWeatherMap с одной keep-alive сессией на все запросы.
+
+    - не больше concurrency запросов одновременно (семафор и лимит соединений)
+    - не чаще rate запросов в секунду (по умолчанию - default_rate(); ограничитель
+      общий для всех клиентов процесса и синхронного get_current_weather)
+    - таймаут на запрос и до retries повторов на 429/5xx и сетевых ошибках
+      с экспоненциальной задержкой и случайным разбросом
+    - если передан cache (WeatherCache), fetch сначала смотрит в него
+
+    Использование:
+        async with WeatherClient(api_key) as client:
+            async for city, weather in client.fetch_many(cities):
+                ...
+    """
+
+    def __init__(self, api_key, base_url=BASE_URL, concurrency=10, rate=None,
+                 timeout=10, retries=3, backoff=0.5, cache=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = shared_bucket(default_rate() if rate is None else rate)
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    async def get(self, path, params, city=''):
+        """
+        GET к API с ограничениями и повторами, возвращает разобранный JSON
+        """
+        params = dict(params, appid=self.api_key)
+        url = f'{self.base_url}/{path}'
+        for attempt in range(self.retries + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            retry_after = None
+            try:
+                async with self._semaphore, metrics.span('weather.request'):
+                    async with self.session.get(url, params=params) as response:
+                        metrics.count('weather.requests')
+                        if response.status == 200:
+                            body = await response.read()
+                            metrics.count('weather.bytes_fetched', len(body))
+                            return json.loads(body)
+                        if response.status not in RETRY_STATUSES or attempt == self.retries:
+                            raise WeatherAPIError(response.status, city, await response.text())
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise WeatherAPIError(None, city, repr(e)) from e
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    async def fetch(self, city):
+        """
+        Текущая погода для города (JSON ответа /weather)
+        """
+        if self.cache is None:
+            return await self.get('weather', {'q': city}, city)
+        return await self.cache.get_or_fetch_async(
+            city, lambda: self.get('weather', {'q': city}, city)
+        )
+
+    async def fetch_group(self, ids):
+        """
+        Текущая погода сразу для нескольких городов по их id (не больше GROUP_SIZE)
+        одним запросом /group. Возвращает список ответов в формате /weather
+        """
+        ids = [str(i) for i in ids]
+        response = await self.get('group', {'id': ','.join(ids)}, city=','.join(ids))
+        return response.get('list', [])
+
+    async def fetch_many(self, cities):
+        """
+        Асинхронный генератор пар (город, погода) в порядке готовности.
+        Вместо погоды приходит исключение, если город получить не удалось
+        """
+        async def fetch_one(city):
+            try:
+                return city, await self.fetch(city)
+            except WeatherAPIError as e:
+                return city, e
+
+        tasks = [asyncio.ensure_future(fetch_one(city)) for city in cities]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def make_session(retries=3, backoff=0.5, pool_size=10):
+    """
+    requests.Session с keep-alive пулом соединений и повторами на 429/5xx
+    для синхронного кода (current_temp, дашборд)
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=['GET'], respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_session = None
+
+
+def get_current_weather(city, api_key, base_url=BASE_URL, timeout=10, session=None, rate=None):
+    """
+    Синхронный запрос текущей погоды через общую сессию, возвращает requests.Response.
+    Лимит частоты rate (по умолчанию default_rate()) общий с асинхронными клиентами
+    """
+    global _session
+    if session is None:
+        if _session is None:
+            _session = make_session()
+        session = _session
+    bucket = shared_bucket(default_rate() if rate is None else rate)
+    if bucket is not None:
+        bucket.acquire_sync()
+    with metrics.span('weather.request'):
+        response = session.get(f"{base_url.rstrip('/')}/weather", params={'q': city, 'appid': api_key},
+                               timeout=timeout)
+    metrics.count('weather.requests')
+    metrics.count('weather.bytes_fetched', len(response.content))
+    return response
+
+
+def fetch_current_weather(city, api_key, base_url=BASE_URL, timeout=10, session=None, cache=None):
+    """
+    Текущая погода (JSON ответа /weather) через общую сессию и, если передан, кэш.
+    При ответе не 200, таймауте или сетевой ошибке бросает WeatherAPIError
+    (у сетевых ошибок status - None, как в WeatherClient.get)
+    """
+    def fetch():
+        try:
+            response = get_current_weather(city, api_key, base_url, timeout, session)
+        except requests.RequestException as e:
+            # в тексте исключения requests есть URL с appid - ключ в сообщение не попадает
+            raise WeatherAPIError(None, city, type(e).__name__) from e
+        if response.status_code != 200:
+            raise WeatherAPIError(response.status_code, city, response.text)
+        return response.json()
+
+    if cache is None:
+        return fetch()
+    return cache.get_or_fetch(city, fetch)